@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# edulint: flake8=--max-line-length=100
+
+"""
+Benchmarks of protocol & encoding hot paths
+
+Usage:
+    bench.py run [options] [<benchmark>...]
+    bench.py compare <old.json> <new.json>
+    bench.py (-h | --help)
+
+Options:
+  -o <filename.json>  Write results to file (default: stdout)
+  -n <count>          Scale of iteration counts [default: 1]
+  --stream-mb=<mb>    Size of generated stream for framing benchmark [default: 4]
+  --capture=<file>    Use received bytes of capture (see sw/capture.py) for framing benchmark
+  --speed=<factor>    Emulator clock speed-up for end-to-end benchmark [default: 20]
+  -l <loglevel>       Specify loglevel (python logging package) [default: warning]
+
+Benchmarks: encode, decode, framing, e2e (all by default)
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import platform
+import threading
+import subprocess
+from typing import Dict, List, Any, Callable, Optional
+import docopt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'sw'))
+sys.path.insert(0, os.path.join(ROOT, 'fw'))
+
+import control  # noqa: E402
+import protocol  # noqa: E402
+import capture  # noqa: E402
+import emulator  # noqa: E402
+
+
+def timeit(func: Callable[[], Any], count: int) -> Dict[str, float]:
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    elapsed = time.perf_counter() - start
+    return {'count': count, 'seconds': elapsed, 'per_second': count/elapsed}
+
+
+def realistic_contents(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rand = random.Random(seed)
+    finals = ['Brno hl.n.', 'Nedvědice', 'Havlíčkův Brod', 'Žďár nad Sázavou', 'Kuřim',
+              'Veselí nad Moravou', 'Tišnov', 'Břeclav', 'Bratislava hl.st.']
+    result = []
+    for _ in range(count):
+        content: Dict[str, Any] = {
+            'type': rand.choice(protocol.FLAP_TYPES),
+            'num': rand.randrange(1, 100000),
+            'num_red': rand.random() < 0.5,
+            'final': rand.choice(finals),
+            'direction1': rand.choice(protocol.FLAP_DIRECTIONS_1),
+            'direction2': rand.choice(protocol.FLAP_DIRECTIONS_2),
+            'time': f'{rand.randrange(24)}:{rand.randrange(60):02}',
+        }
+        if rand.random() < 0.3:
+            content['delay'] = str(rand.randrange(500))
+        result.append(content)
+    return result
+
+
+###############################################################################
+# Benchmarks
+
+def bench_encode(scale: float) -> Dict[str, Any]:
+    contents = realistic_contents(1000)
+    count = int(50 * scale)
+    uncached = protocol.Encoder(cache_size=0)
+    cached = protocol.Encoder(cache_size=len(contents))
+
+    def encode_all(encoder: protocol.Encoder) -> None:
+        for content in contents:
+            encoder.encode(content)
+
+    result = {
+        'uncached': timeit(lambda: encode_all(uncached), count),
+        'cached': timeit(lambda: encode_all(cached), count),
+    }
+    for item in result.values():
+        item['per_second'] *= len(contents)
+    return result
+
+
+def bench_decode(scale: float) -> Dict[str, Any]:
+    vectors = [protocol.flap_all_positions(content) for content in realistic_contents(1000)]
+    count = int(20 * scale)
+
+    def decode_all() -> None:
+        for vector in vectors:
+            protocol.explain_positions(vector)
+
+    result = timeit(decode_all, count)
+    result['per_second'] *= len(vectors)
+    return result
+
+
+def recorded_stream(size: int, seed: int = 0) -> bytes:
+    # Frames as sent by the firmware with garbage & corrupted checksums injected
+    rand = random.Random(seed)
+    vectors = [protocol.flap_all_positions(content) for content in realistic_contents(100)]
+    result = bytearray()
+    while len(result) < size:
+        side = rand.randrange(2)
+        kind = rand.random()
+        if kind < 0.4:
+            data = emulator.frame(protocol.UART_MSG_SM_POS, [side | 2] + rand.choice(vectors))
+        elif kind < 0.8:
+            data = emulator.frame(protocol.UART_MSG_SM_SENS,
+                                  [side] + [rand.randrange(256) for _ in range(8)])
+        else:
+            data = emulator.frame(protocol.UART_MSG_SM_TARGET, [side] + rand.choice(vectors))
+        if rand.random() < 0.01:
+            data = data[:-1] + bytes([data[-1] ^ 0x55])  # bad checksum
+        if rand.random() < 0.05:
+            result += bytes(rand.randrange(256) for _ in range(rand.randrange(1, 8)))
+        result += data
+    return bytes(result)
+
+
+class NullProgram:
+    def received_positions(self, *args) -> None:
+        pass
+
+    def received_target(self, *args) -> None:
+        pass
+
+    def received_sensors(self, *args) -> None:
+        pass
+
+
+def bench_framing(stream_mb: float, capture_file: Optional[str] = None) -> Dict[str, Any]:
+    if capture_file is not None:
+        stream = capture.received_stream(capture_file)
+    else:
+        stream = recorded_stream(int(stream_mb * 1024 * 1024))
+    logging.disable(logging.WARNING)  # invalid xor warnings
+    try:
+        result = {}
+        for chunk_size in [64, 4096]:
+            decoder = protocol.FrameDecoder()
+            program = NullProgram()
+            frames = 0
+            start = time.perf_counter()
+            for i in range(0, len(stream), chunk_size):
+                for frame in decoder.feed(stream[i:i+chunk_size]):
+                    control.parse(frame, program)
+                    frames += 1
+            elapsed = time.perf_counter() - start
+            result[f'chunk_{chunk_size}'] = {
+                'bytes': len(stream),
+                'frames': frames,
+                'seconds': elapsed,
+                'mb_per_second': len(stream) / elapsed / 1024 / 1024,
+                'frames_per_second': frames / elapsed,
+                'discarded': decoder.discarded,
+                'xor_errors': decoder.xor_errors,
+            }
+    finally:
+        logging.disable(logging.NOTSET)
+    return result
+
+
+def bench_e2e(speed: float, scale: float) -> Dict[str, Any]:
+    import solari_board
+
+    master, slave, path = emulator.open_pty()
+    board_emulator = emulator.Emulator(initialized=True, seed=0)
+    threading.Thread(target=emulator.serve, args=(board_emulator, master, slave, speed),
+                     daemon=True).start()
+    contents = realistic_contents(max(int(5 * scale), 1), seed=1)
+
+    async def run() -> Dict[str, Any]:
+        ack: List[float] = []
+        done: List[float] = []
+        async with solari_board.SolariBoard(path) as board:
+            await board.wait_initialized('A', timeout=10)
+            for content in contents:
+                start = time.perf_counter()
+                await board.set_positions('A', content, wait=False)
+                await board.get_state('A', timeout=10)
+                ack.append(time.perf_counter() - start)
+                await board.set_positions('A', content, wait=True, timeout=120)
+                done.append((time.perf_counter() - start) * speed)
+        return {
+            'updates': len(contents),
+            'emulator_speed': speed,
+            'ack_ms': {'mean': 1000*sum(ack)/len(ack), 'max': 1000*max(ack)},
+            'reached_s': {'mean': sum(done)/len(done), 'max': max(done)},
+        }
+
+    return asyncio.run(run())
+
+
+###############################################################################
+# Results
+
+def metadata() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def flatten(data: Dict[str, Any], prefix: str = '') -> Dict[str, float]:
+    result = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            result.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            result[f'{prefix}{key}'] = value
+    return result
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> None:
+    print(f'{old["meta"]["commit"]} -> {new["meta"]["commit"]}')
+    old_flat, new_flat = flatten(old['results']), flatten(new['results'])
+    for key in sorted(old_flat.keys() & new_flat.keys()):
+        if old_flat[key] == 0:
+            continue
+        ratio = new_flat[key] / old_flat[key]
+        print(f'{key:50} {old_flat[key]:14.3f} {new_flat[key]:14.3f} {ratio:7.2f}x')
+
+
+###############################################################################
+# Main
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+
+    loglevel = {
+        'debug': logging.DEBUG,
+        'info': logging.INFO,
+        'warning': logging.WARNING,
+        'error': logging.ERROR,
+        'critical': logging.CRITICAL,
+    }.get(args['-l'], logging.WARNING)
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=loglevel,
+        format='[%(asctime)s.%(msecs)03d] %(levelname)s %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+
+    if args['compare']:
+        with open(args['<old.json>']) as f:
+            old = json.load(f)
+        with open(args['<new.json>']) as f:
+            new = json.load(f)
+        compare(old, new)
+        sys.exit(0)
+
+    scale = float(args['-n'])
+    BENCHMARKS = {
+        'encode': lambda: bench_encode(scale),
+        'decode': lambda: bench_decode(scale),
+        'framing': lambda: bench_framing(float(args['--stream-mb']), args['--capture']),
+        'e2e': lambda: bench_e2e(float(args['--speed']), scale),
+    }
+    selected = args['<benchmark>'] or list(BENCHMARKS.keys())
+    for name in selected:
+        assert name in BENCHMARKS, f'Unknown benchmark: {name}'
+
+    results = {}
+    for name in selected:
+        logging.info(f'Running {name}...')
+        results[name] = BENCHMARKS[name]()
+
+    output = json.dumps({'meta': metadata(), 'results': results}, indent='    ')
+    if args['-o']:
+        with open(args['-o'], 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# edulint: flake8=--max-line-length=100
+
+"""
+Solari-Control firmware emulator
+
+Emulates UART protocol & flapping of the ATmega firmware (src/main.c, src/uart.c,
+src/flap.c) on a pseudo-terminal, so control.py, read.py & hJOP integration
+can run without the board.
+
+Usage:
+    emulator.py [options]
+    emulator.py (-h | --help)
+
+Options:
+  -l <loglevel>             Specify loglevel (python logging package) [default: info]
+  -L --link=<path>          Create symlink <path> to the pseudo-terminal
+  --speed=<factor>          Run clock <factor> times faster than real time [default: 1]
+  --counts=<filename.json>  Number of flaps of units (list of 26 ints or {"A": [...], "B": [...]})
+  --initialized             Start with known positions (as after first turn of all units)
+  --stuck=<units>           Comma-separated units that never move, e.g. A3,B12
+  --noise=<p>               Probability of a garbage byte before each sent byte [default: 0]
+  --drop=<p>                Probability of dropping each sent byte [default: 0]
+  --seed=<n>                Random seed for noise & drops
+"""
+
+import os
+import sys
+import json
+import tty
+import time
+import fcntl
+import random
+import select
+import struct
+import termios
+import logging
+from typing import List, Set, Optional, Tuple
+import docopt
+
+UART_RECEIVE_MAGIC = 0xCA  # from the MCU point of view, see src/uart.h
+UART_SEND_MAGIC = 0xB7
+UART_RECEIVE_TIMEOUT = 0.010  # s
+UART_INPUT_BUF_MAX_SIZE = 64
+
+UART_MSG_MS_GET_SENS = 0x01
+UART_MSG_MS_GET_POS = 0x02
+UART_MSG_MS_GET_TARGET = 0x03
+UART_MSG_MS_FLAP = 0x10
+UART_MSG_MS_SET_SINGLE = 0x11
+UART_MSG_MS_SET_ALL = 0x12
+
+UART_MSG_SM_SENS = 0x01
+UART_MSG_SM_POS = 0x02
+UART_MSG_SM_TARGET = 0x03
+
+FLAP_SIDES = 2
+FLAP_BYTES = 4
+FLAP_UNITS = 26
+FLAP_CLAP_PERIOD = 0.150  # s
+FLAP_ACTIVE_OUT = 0.080  # s
+FLAP_MAX_FLAPS_SINCE_INCR = 5
+FLAP_MAX_FLAPS_SINCE_RESET = 85
+
+PTY_MAX_PENDING = 1024  # bytes not read by client, older data are thrown away like on overrun
+
+# Physical number of flaps of units: type, number x5, final x6, directions, hours, minutes
+# tenths, final x8, minutes ones, delay
+DEFAULT_COUNTS = [26] + [21]*5 + [60]*6 + [68, 79, 25, 7] + [60]*8 + [11, 40]
+
+
+def xor(data) -> int:
+    result = 0
+    for byte in data:
+        result ^= byte
+    return result
+
+
+def frame(msgtype: int, data: List[int]) -> bytes:
+    result = [UART_SEND_MAGIC, len(data), msgtype] + data
+    result.append(xor(result))
+    return bytes(result)
+
+
+class Side:
+    def __init__(self, counts: List[int], initialized: bool, stuck: Set[int],
+                 rand: random.Random):
+        # flap really shown
+        self.physical = [0 if initialized else rand.randrange(count) for count in counts]
+        self.real_counts = counts
+        self.stuck = stuck
+        self.pos = [0 if initialized else 0xFF]*FLAP_UNITS
+        self.counts = counts[:] if initialized else [0xFF]*FLAP_UNITS  # learned by firmware
+        self.target = [0]*FLAP_UNITS
+        self.sens_moved = [0]*FLAP_UNITS
+        self.flaps_since_incr = [0]*FLAP_UNITS
+        self.flaps_since_reset = [0]*FLAP_UNITS
+
+    def sens_bytes(self) -> List[int]:
+        moved = [0]*FLAP_BYTES
+        reset = [0]*FLAP_BYTES
+        for i in range(FLAP_UNITS):
+            moved[i//8] |= self.sens_moved[i] << (i % 8)
+            reset[i//8] |= (self.physical[i] == 0) << (i % 8)
+        return moved + reset
+
+    def set_single(self, unit: int, pos: int) -> None:
+        if unit < FLAP_UNITS:
+            self.target[unit] = pos if pos < self.counts[unit] else 0
+            self.flaps_since_incr[unit] = 0
+            self.flaps_since_reset[unit] = 0
+
+    def set_all(self, positions: List[int]) -> None:
+        self.flaps_since_incr = [0]*FLAP_UNITS
+        self.flaps_since_reset = [0]*FLAP_UNITS
+        self.target = [pos if pos < count else 0 for pos, count in zip(positions, self.counts)]
+
+    def target_reached(self) -> bool:
+        return self.pos == self.target
+
+    def target_reached_ignore_errors(self) -> bool:
+        return all(
+            self.pos[i] == self.target[i] or
+            self.flaps_since_incr[i] >= FLAP_MAX_FLAPS_SINCE_INCR or
+            self.flaps_since_reset[i] >= FLAP_MAX_FLAPS_SINCE_RESET
+            for i in range(FLAP_UNITS)
+        )
+
+    def to_flap(self) -> List[int]:
+        result = [i for i in range(FLAP_UNITS) if self.pos[i] != self.target[i]]
+        for i in result:
+            self.flaps_since_incr[i] = min(self.flaps_since_incr[i]+1, 0xFF)
+        return result
+
+    def flap(self, units: List[int]) -> None:
+        for i in units:
+            if i in self.stuck:
+                continue
+            self.physical[i] = (self.physical[i]+1) % self.real_counts[i]
+            self.sens_moved[i] ^= 1
+            # _update_moved in src/flap.c
+            self.flaps_since_incr[i] = 0
+            self.flaps_since_reset[i] = min(self.flaps_since_reset[i]+1, 0xFF)
+            if self.pos[i] < 0xFF:
+                self.pos[i] += 1
+            if self.physical[i] == 0:
+                self.flaps_since_reset[i] = 0
+                if 0 < self.pos[i] < 0xFF:
+                    self.counts[i] = self.pos[i]
+                self.pos[i] = 0
+            if self.target[i] >= self.counts[i]:
+                self.target[i] = 0
+
+
+class Emulator:
+    """Firmware state machine, independent of I/O: feed() received bytes, tick() with current
+    time (in emulated seconds) and collect bytes to send from output()."""
+
+    def __init__(self, counts: Optional[List[List[int]]] = None, initialized: bool = False,
+                 stuck: Optional[Set[Tuple[int, int]]] = None, noise: float = 0,
+                 drop: float = 0, seed: Optional[int] = None):
+        counts = counts or [DEFAULT_COUNTS, DEFAULT_COUNTS]
+        stuck = stuck or set()
+        self.random = random.Random(seed)
+        self.sides = [
+            Side(counts[side], initialized, {unit for s, unit in stuck if s == side}, self.random)
+            for side in range(FLAP_SIDES)
+        ]
+        self.noise = noise
+        self.drop = drop
+        self.input_buf = bytearray()
+        self.last_receive = 0.0
+        self.output_buf = bytearray()
+        self.flap_side: Optional[int] = None
+        self.next_clap = 0.0
+        self.pending_flap: Optional[Tuple[float, int, List[int]]] = None  # (time, side, units)
+        self.now = 0.0
+
+    # Receiving (src/uart.c, uart_process_received in src/main.c)
+
+    def feed(self, data: bytes, now: float) -> None:
+        self.now = now
+        for byte in data:
+            if self.input_buf and now - self.last_receive > UART_RECEIVE_TIMEOUT:
+                self.input_buf.clear()
+            self.last_receive = now
+            if not self.input_buf:
+                if byte == UART_RECEIVE_MAGIC:
+                    self.input_buf.append(byte)
+                continue
+            self.input_buf.append(byte)
+            length = self.input_buf[1] + 4
+            if length >= UART_INPUT_BUF_MAX_SIZE:
+                self.input_buf.clear()
+            elif len(self.input_buf) == length:
+                if xor(self.input_buf) == 0:
+                    self.process(bytes(self.input_buf))
+                else:
+                    logging.debug(f'Invalid xor: {list(self.input_buf)}')
+                self.input_buf.clear()
+
+    def process(self, data: bytes) -> None:
+        logging.debug(f'> Received: {list(data)}')
+        data_len, msgtype = data[1], data[2]
+        if msgtype == UART_MSG_MS_GET_SENS:
+            self.send_sens()
+        elif msgtype == UART_MSG_MS_GET_POS:
+            self.send_pos()
+        elif msgtype == UART_MSG_MS_GET_TARGET:
+            self.send_target()
+        elif msgtype == UART_MSG_MS_FLAP:
+            if data_len >= 2 and data[3] < FLAP_SIDES:
+                side = self.sides[data[3]]
+                unit = data[4]
+                if unit < FLAP_UNITS and side.target[unit] != 0xFF:
+                    side.set_single(unit, side.target[unit]+1)
+                    self.send_target(data[3])
+        elif msgtype == UART_MSG_MS_SET_SINGLE:
+            if data_len >= 3 and data[3] < FLAP_SIDES:
+                self.sides[data[3]].set_single(data[4], data[5])
+                self.send_target(data[3])
+        elif msgtype == UART_MSG_MS_SET_ALL:
+            if data_len >= FLAP_UNITS+1 and data[3] < FLAP_SIDES:
+                self.sides[data[3]].set_all(list(data[4:4+FLAP_UNITS]))
+                self.send_target(data[3])
+
+    # Sending
+
+    def _send(self, data: bytes) -> None:
+        for byte in data:
+            if self.noise and self.random.random() < self.noise:
+                self.output_buf.append(self.random.randrange(256))
+            if self.drop and self.random.random() < self.drop:
+                continue
+            self.output_buf.append(byte)
+
+    def send_sens(self, side: Optional[int] = None) -> None:
+        for i in ([side] if side is not None else range(FLAP_SIDES)):
+            self._send(frame(UART_MSG_SM_SENS, [i] + self.sides[i].sens_bytes()))
+
+    def send_pos(self, side: Optional[int] = None) -> None:
+        for i in ([side] if side is not None else range(FLAP_SIDES)):
+            s = self.sides[i]
+            flags = i | (s.target_reached() << 1) | (s.target_reached_ignore_errors() << 2)
+            self._send(frame(UART_MSG_SM_POS, [flags] + s.pos))
+
+    def send_target(self, side: Optional[int] = None) -> None:
+        for i in ([side] if side is not None else range(FLAP_SIDES)):
+            self._send(frame(UART_MSG_SM_TARGET, [i] + self.sides[i].target))
+
+    def output(self) -> bytes:
+        result = bytes(self.output_buf)
+        self.output_buf.clear()
+        return result
+
+    # Flapping (flap_single_clap in src/flap.c)
+
+    def next_event(self) -> float:
+        if self.pending_flap is not None:
+            return min(self.next_clap, self.pending_flap[0])
+        return self.next_clap
+
+    def tick(self, now: float) -> None:
+        self.now = now
+        if self.pending_flap is not None and now >= self.pending_flap[0]:
+            _, side, units = self.pending_flap
+            self.pending_flap = None
+            self.sides[side].flap(units)
+            self.send_sens()
+            self.send_pos()
+
+        if now >= self.next_clap:
+            self.next_clap = max(self.next_clap + FLAP_CLAP_PERIOD, now)
+            self.clap()
+
+    def clap(self) -> None:
+        if self.pending_flap is not None:
+            return
+        reached = [side.target_reached_ignore_errors() for side in self.sides]
+        if all(reached):
+            self.flap_side = None
+            self.send_sens()
+            self.send_pos()
+            return
+        if self.flap_side is None or reached[self.flap_side]:
+            self.flap_side = 1 if reached[0] else 0
+            return  # flap next cycle
+
+        units = self.sides[self.flap_side].to_flap()
+        self.pending_flap = (self.now + FLAP_ACTIVE_OUT, self.flap_side, units)
+
+
+def parse_stuck(stuck: str) -> Set[Tuple[int, int]]:
+    result = set()
+    for item in stuck.split(','):
+        item = item.strip().upper()
+        assert len(item) >= 2 and item[0] in 'AB', f'Invalid unit: {item}'
+        result.add(('AB'.index(item[0]), int(item[1:])))
+    return result
+
+
+def load_counts(filename: str) -> List[List[int]]:
+    with open(filename) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return [data['A'], data['B']]
+    return [data, data]
+
+
+def pending(fd: int) -> int:
+    return struct.unpack('i', fcntl.ioctl(fd, termios.FIONREAD, b'\0\0\0\0'))[0]
+
+
+def serve(emulator: Emulator, fd: int, slave: int, speed: float = 1) -> None:
+    """Run `emulator` on master side `fd` of a pty forever."""
+    start = time.monotonic()
+
+    def emulated_time() -> float:
+        return (time.monotonic() - start) * speed
+
+    while True:
+        timeout = max(emulator.next_event() - emulated_time(), 0) / speed
+        readable, _, _ = select.select([fd], [], [], timeout)
+        if readable:
+            try:
+                data = os.read(fd, 4096)
+            except OSError:
+                data = b''  # no slave open
+            emulator.feed(data, emulated_time())
+        emulator.tick(emulated_time())
+        output = emulator.output()
+        if output:
+            if pending(slave) > PTY_MAX_PENDING:
+                termios.tcflush(slave, termios.TCIFLUSH)
+            os.write(fd, output)
+
+
+def open_pty() -> Tuple[int, int, str]:
+    # Slave stays open in the emulator, so the master does not fail when client disconnects
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    return master, slave, os.ttyname(slave)
+
+
+###############################################################################
+# Main
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+
+    loglevel = {
+        'debug': logging.DEBUG,
+        'info': logging.INFO,
+        'warning': logging.WARNING,
+        'error': logging.ERROR,
+        'critical': logging.CRITICAL,
+    }.get(args['-l'], logging.INFO)
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=loglevel,
+        format='[%(asctime)s.%(msecs)03d] %(levelname)s %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+
+    emulator = Emulator(
+        counts=load_counts(args['--counts']) if args['--counts'] else None,
+        initialized=args['--initialized'],
+        stuck=parse_stuck(args['--stuck']) if args['--stuck'] else None,
+        noise=float(args['--noise']),
+        drop=float(args['--drop']),
+        seed=int(args['--seed']) if args['--seed'] else None,
+    )
+
+    master, slave, path = open_pty()
+    if args['--link']:
+        if os.path.lexists(args['--link']):
+            os.unlink(args['--link'])
+        os.symlink(path, args['--link'])
+        path = args['--link']
+    logging.info(f'Emulating board on {path}')
+
+    try:
+        serve(emulator, master, slave, float(args['--speed']))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args['--link']:
+            os.unlink(args['--link'])
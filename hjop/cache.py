@@ -0,0 +1,101 @@
+# edulint: flake8=--max-line-length=100
+
+"""
+Caching layer in front of hJOPserver PT lookups
+
+Areas are prefetched once per connection and kept for the whole session,
+train records are kept for a short time and invalidated by block changes,
+block states are taken from their change events.
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+from ac import pt as pt
+
+TRAIN_TTL = 10  # seconds
+
+V = TypeVar('V')
+
+
+class TTLCache(Generic[V]):
+    def __init__(self, ttl: float, maxsize: int = 256):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.items: OrderedDict[Hashable, Tuple[float, V]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, loader: Callable[[], V]) -> V:
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None and item[0] > time.monotonic():
+                self.items.move_to_end(key)
+                return item[1]
+
+        value = loader()
+        with self.lock:
+            self.items[key] = (time.monotonic() + self.ttl, value)
+            self.items.move_to_end(key)
+            if len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+        return value
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        with self.lock:
+            if key is None:
+                self.items.clear()
+            else:
+                self.items.pop(key, None)
+
+
+_areas: Dict[str, str] = {}
+_trains: TTLCache[Dict[str, Any]] = TTLCache(TRAIN_TTL)
+_blocks: Dict[int, Dict[str, Any]] = {}
+
+
+def prefetch_areas() -> None:
+    _areas.clear()
+    for area in pt.get('/areas')['areas']:
+        _areas[str(area['id'])] = area['name']
+    logging.info(f'Prefetched {len(_areas)} areas')
+
+
+def area_name(area_id: Any) -> str:
+    key = str(area_id)
+    if key not in _areas:
+        _areas[key] = pt.get(f'/areas/{area_id}')['area']['name']
+    return _areas[key]
+
+
+def train(train_id: Any) -> Dict[str, Any]:
+    return _trains.get(str(train_id), lambda: pt.get(f'/trains/{train_id}')['train'])
+
+
+def invalidate_trains() -> None:
+    _trains.invalidate()
+
+
+def block_state(block: Dict[str, Any]) -> Dict[str, Any]:
+    # Normalizes block from change event / PT response to block state
+    return block['blockState'] if 'blockState' in block else block
+
+
+def update_block(block_id: int, block: Dict[str, Any]) -> Dict[str, Any]:
+    state = block_state(block)
+    _blocks[block_id] = state
+    return state
+
+
+def block(block_id: int, loader: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    if block_id not in _blocks:
+        _blocks[block_id] = block_state(loader())
+    return _blocks[block_id]
+
+
+def clear() -> None:
+    _areas.clear()
+    _trains.invalidate()
+    _blocks.clear()
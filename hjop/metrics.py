@@ -0,0 +1,133 @@
+# edulint: flake8=--max-line-length=100
+
+"""
+Latency metrics of the hJOP -> board pipeline
+
+Stages are timed with span(), durations are kept in rolling windows per
+(stage, track) and exposed in Prometheus text format over HTTP and as periodic
+JSON log lines.
+"""
+
+import json
+import time
+import logging
+import threading
+import contextlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple, Iterator, Deque, Any, Optional
+
+WINDOW = 256  # last durations kept per histogram
+
+
+class Histogram:
+    def __init__(self, window: int = WINDOW):
+        self.values: Deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.values.append(value)
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        if not self.values:
+            return 0.0
+        values = sorted(self.values)
+        return values[min(int(q * len(values)), len(values)-1)]
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'max': max(self.values, default=0.0),
+            'count': self.count,
+        }
+
+
+_lock = threading.Lock()
+_histograms: Dict[Tuple[str, str], Histogram] = {}
+
+
+def observe(stage: str, track: Any, seconds: float) -> None:
+    with _lock:
+        key = (stage, str(track))
+        if key not in _histograms:
+            _histograms[key] = Histogram()
+        _histograms[key].observe(seconds)
+
+
+def record(stage: str, track: Any, seconds: float, train: Optional[str] = None) -> None:
+    # Same as span() for stages timed elsewhere
+    observe(stage, track, seconds)
+    logging.debug(f'Span {stage} track={track} train={train}: {seconds*1000:.1f} ms')
+
+
+@contextlib.contextmanager
+def span(stage: str, track: Any, train: Optional[str] = None) -> Iterator[None]:
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        record(stage, track, time.monotonic() - start, train)
+
+
+def summary() -> Dict[str, Dict[str, Dict[str, float]]]:
+    result: Dict[str, Dict[str, Dict[str, float]]] = {}
+    with _lock:
+        for (stage, track), histogram in sorted(_histograms.items()):
+            result.setdefault(track, {})[stage] = histogram.summary()
+    return result
+
+
+def prometheus() -> str:
+    lines = [
+        '# HELP solari_stage_seconds Duration of hJOP -> board pipeline stages',
+        '# TYPE solari_stage_seconds summary',
+    ]
+    with _lock:
+        for (stage, track), histogram in sorted(_histograms.items()):
+            labels = f'stage="{stage}",track="{track}"'
+            for q in [0.5, 0.95, 1.0]:
+                value = histogram.quantile(q) if q < 1 else max(histogram.values, default=0.0)
+                lines.append(f'solari_stage_seconds{{{labels},quantile="{q}"}} {value:.6f}')
+            lines.append(f'solari_stage_seconds_sum{{{labels}}} {histogram.sum:.6f}')
+            lines.append(f'solari_stage_seconds_count{{{labels}}} {histogram.count}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass  # do not spam log with scrapes
+
+
+def serve(port: int, host: str = '127.0.0.1') -> None:
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f'Metrics available at http://{host}:{port}/metrics')
+
+
+def log_periodically(interval: float) -> None:
+    def log() -> None:
+        data = summary()
+        if data:
+            logging.info(f'Metrics: {json.dumps(data)}')
+        timer = threading.Timer(interval, log)
+        timer.daemon = True
+        timer.start()
+
+    timer = threading.Timer(interval, log)
+    timer.daemon = True
+    timer.start()
@@ -0,0 +1,73 @@
+# edulint: flake8=--max-line-length=100
+
+"""
+Look-ahead queue of upcoming departures per track
+
+Train records carry departure times (podj) for tracks of their route. Every
+train seen by any track is remembered here for the served tracks until it
+departs, so a board which would otherwise be blank can pre-roll units of the
+earliest upcoming departure of its track (number, destination, time). When the
+train is assigned to the track, only the few remaining units have to move.
+"""
+
+import datetime
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# podj absolute times are one hour behind local time (see train_content in solari.py)
+PODJ_OFFSET = datetime.timedelta(hours=1)
+
+
+def departure(train: Dict[str, Any], track_id: int) -> Optional[datetime.datetime]:
+    podj_time = train.get('podj', {}).get(str(track_id), {}).get('absolute', None)
+    if podj_time is None:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(podj_time).replace(tzinfo=None) + PODJ_OFFSET
+    except ValueError:
+        return None
+
+
+Departures = Dict[str, Tuple[datetime.datetime, Dict[str, Any]]]  # train name -> (time, train)
+
+
+def prune(departures: Departures, now: datetime.datetime) -> None:
+    for name in [name for name, (time, _) in departures.items() if time < now]:
+        del departures[name]
+
+
+class Schedule:
+    def __init__(self, horizon: datetime.timedelta, tracks: Iterable[int]):
+        self.horizon = horizon
+        self.lock = threading.Lock()
+        # Only served tracks are kept, departures from other tracks are ignored
+        self.departures: Dict[int, Departures] = {track: {} for track in tracks}
+
+    def observe(self, train: Dict[str, Any], now: Optional[datetime.datetime] = None) -> None:
+        # Past departures of tracks the train is added to are dropped, so memory stays bounded
+        now = now if now is not None else datetime.datetime.now()
+        with self.lock:
+            for track in train.get('podj', {}).keys():
+                if not str(track).isdecimal() or int(track) not in self.departures:
+                    continue
+                departures = self.departures[int(track)]
+                time = departure(train, int(track))
+                if time is not None:
+                    departures[train['name']] = (time, train)
+                prune(departures, now)
+
+    def upcoming(self, track_id: int,
+                 now: Optional[datetime.datetime] = None) -> List[Dict[str, Any]]:
+        # Returns trains departing from `track_id` within horizon, earliest first
+        now = now if now is not None else datetime.datetime.now()
+        with self.lock:
+            departures = self.departures.get(track_id, {})
+            prune(departures, now)
+            ahead = sorted((item for item in departures.values() if item[0] - now <= self.horizon),
+                           key=lambda item: item[0])
+        return [train for _, train in ahead]
+
+    def clear(self) -> None:
+        with self.lock:
+            for departures in self.departures.values():
+                departures.clear()
@@ -5,12 +5,19 @@ Solari di Control platform table hJOP integration
 
 Usage:
   solari.py [options] <track_id>
+  solari.py [options] --config=<filename.json>
   solari.py --version
 
 Options:
   -s <servername>    Specify hJOPserver address [default: 127.0.0.1]
   -p <port>          Specify hJOPserver port [default: 5896]
   -l <loglevel>      Specify loglevel (python logging package) [default: info]
+  -m <port>          Latency metrics HTTP port on localhost, 0 = off [default: 9105]
+  --metrics-log=<s>  Log latency metrics as JSON every <s> seconds (0 = off) [default: 300]
+  -d <ms>            Wait for no block event for <ms> before updating board [default: 300]
+  --config=<file>    Serve tracks & boards from config file (see solari.example.json)
+  --lookahead=<min>  Pre-roll departures up to <min> ahead on blank board, 0 = off [default: 30]
+  --preroll-unannounced  Pre-roll also trains not announced by hJOP (shown to passengers early)
   -h --help          Show this screen.
   --version          Show version.
 """
@@ -18,8 +25,12 @@ Options:
 import sys
 import logging
 from docopt import docopt  # type: ignore
-from typing import Dict
+from typing import Dict, List, Optional, Callable
 import subprocess
+import threading
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor
 import json
 
 import ac.blocks
@@ -28,8 +39,13 @@ import ac.events as events
 import utils.blocks
 from ac import pt as pt
 
+import metrics
+import cache
+from schedule import Schedule
+from updater import Updater
+
 DEVICE = '/dev/ttyAMA0'
-SIDES = ['A', 'B']
+SIDES = 'AB'  # both sides at once
 
 TYPES = {
     'Ec': 'Ec',
@@ -43,98 +59,273 @@ TYPES = {
 }
 
 ENABLE_BLOCK_ID = 5001
-
-
-def show_train(train: Dict) -> bool:
-    global track_id
-    logging.info(f'Showing train {train} ...')
-
-    if not train.get('announcement', False):
-        return False
-    if train['type'] not in TYPES:
-        return False
-
-    trainnum = int(train['name'][-5:])
-
-    content = {
-        'num': trainnum,
-        'type': TYPES[train['type']],
-        'num_red': train['type'] in ['Ec', 'Ic', 'Ex', 'R'],
-        'direction2': 'S3',
-    }
-
-    if 'areaTo' in train:
-        content['final'] = pt.get(f'/areas/{train["areaTo"]}')['area']['name']
-
-    if content['final'] == 'Odbočka Čejč':
-        content['final'] = 'Brno hlavní n.'
-        content['direction1'] = 'Vranovice'
-
-    podj_time = train.get('podj', {}).get(str(track_id), {}).get('absolute', None)
-    if podj_time is not None:
-        date, time = podj_time.split('T')
-        hours, minutes, seconds = time.split(':')
-        hours = str(int(hours)+1)
-        content['time'] = f'{hours}:{minutes}'
-
-    with open('content.json', 'w') as file:
-        file.write(json.dumps(content, indent='\t', ensure_ascii=False))
-
-    for side in SIDES:
-        result = subprocess.run(
-            ['../sw/control.py', 'set_positions', '--file=content.json', DEVICE, side]
-        )
-        if result.returncode != 0:
-            logging.error('control.py returned nonzero status!')
-            return False
-    return True
-
-
-def clear() -> None:
-    logging.info('Resetting...')
-    for side in SIDES:
-        subprocess.run(['../sw/control.py', 'reset', DEVICE, side])
-
-
-def on_enable_change(block) -> None:
-    global track_id
-    on_track_change(utils.blocks.state(track_id))
-
-
-def on_track_change(block) -> None:
-    if not utils.blocks.state(ENABLE_BLOCK_ID).get('activeOutput', False):
-        logging.info('on_track_change: enable block disabled.')
-        return
-
-    if 'blockState' in block:
-        block = block['blockState']
-    trains = block.get('trains', [])
-    predict = block.get('trainPredict', '')
-    train = None
-
-    if trains:
-        train = pt.get(f'/trains/{trains[0]}')['train']
-    elif predict != '':
-        train = pt.get(f'/trains/{predict}')['train']
-
-    if train is not None:
-        ok = show_train(train)
-        if ok:
-            logging.info('Done')
+DEFAULTS = {'direction2': 'S3'}
+CANCEL_POLL_PERIOD = 0.05  # seconds
+# Stages reported by control.py --stages, span measured from the previous one (or spawn)
+CONTROL_STAGES = [
+    ('synced', 'control_startup'),  # process & port open, board state known
+    ('sent', 'control_send'),
+    ('reached', 'control_mechanics'),  # units in place
+]
+CONTROL_TIMEOUT_STATUS = 2  # control.py -w: units not in place in time
+PT_WORKERS = 4
+# Units moved ahead of time on blank board, the rest moves when train is assigned
+PREROLL_KEYS = ['num', 'num_red', 'final', 'time']
+
+# PT requests are done here, never on the panel client thread
+pt_pool = ThreadPoolExecutor(max_workers=PT_WORKERS, thread_name_prefix='pt')
+
+
+class DeviceLock:
+    """Serial port of a board, used by one control.py at a time.
+
+    Tracks shown on different sides of the same board must not use the port concurrently.
+    A holder only waiting for mechanics (all frames sent) checks contended() and gives way.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counter_lock = threading.Lock()
+        self.waiting = 0
+
+    def __enter__(self) -> 'DeviceLock':
+        with self.counter_lock:
+            self.waiting += 1
+        self.lock.acquire()
+        with self.counter_lock:
+            self.waiting -= 1
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.lock.release()
+
+    def contended(self) -> bool:
+        return self.waiting > 0
+
+
+class Track:
+    """Single track shown on (sides of) a board, has its own update worker."""
+
+    def __init__(self, config: Dict, debounce: float):
+        self.id = int(config['track'])
+        self.device = config.get('device', DEVICE)
+        self.sides = config.get('sides', SIDES)
+        self.enable_block = int(config.get('enable_block', ENABLE_BLOCK_ID))
+        self.defaults = config.get('defaults', DEFAULTS)
+        self.content_file = f'content-{self.id}.json'
+        self.device_lock = device_locks.setdefault(self.device, DeviceLock())
+        self.updater = Updater(self.desired_content, self.apply, debounce, f'track-{self.id}')
+        self.train: Optional[str] = None  # train of content returned by desired_content
+
+    def train_content(self, train: Dict, announced_only: bool = True) -> Optional[Dict]:
+        logging.info(f'Track {self.id}: train {train} ...')
+
+        if announced_only and not train.get('announcement', False):
+            return None
+        if train['type'] not in TYPES:
+            return None
+
+        trainnum = int(train['name'][-5:])
+
+        content = {
+            'num': trainnum,
+            'type': TYPES[train['type']],
+            'num_red': train['type'] in ['Ec', 'Ic', 'Ex', 'R'],
+        }
+        content.update(self.defaults)
+
+        if 'areaTo' in train:
+            with metrics.span('pt_area', self.id, train['name']):
+                content['final'] = cache.area_name(train['areaTo'])
+
+        if content['final'] == 'Odbočka Čejč':
+            content['final'] = 'Brno hlavní n.'
+            content['direction1'] = 'Vranovice'
+
+        podj_time = train.get('podj', {}).get(str(self.id), {}).get('absolute', None)
+        if podj_time is not None:
+            date, time = podj_time.split('T')
+            hours, minutes, seconds = time.split(':')
+            hours = str(int(hours)+1)
+            content['time'] = f'{hours}:{minutes}'
+
+        return content
+
+    def apply(self, content: Dict, cancel: threading.Event) -> bool:
+        train = self.train
+        if content:
+            logging.info(f'Track {self.id}: showing {content} ...')
+            with metrics.span('write_content', self.id, train):
+                with open(self.content_file, 'w') as file:
+                    file.write(json.dumps(content, indent='\t', ensure_ascii=False))
+            command = ['../sw/control.py', 'set_positions', '-w', '--stages',
+                       f'--file={self.content_file}', self.device, self.sides]
         else:
-            logging.info('show_train returned False!')
-            clear()
-    else:
-        clear()
+            logging.info(f'Track {self.id}: resetting...')
+            command = ['../sw/control.py', 'reset', '-w', '--stages', self.device, self.sides]
+
+        with self.device_lock, metrics.span('control', self.id, train):
+            if cancel.is_set():
+                return False
+            spawned = time.monotonic()
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+            stages: Dict[str, float] = {}  # stage -> time reported
+            reader = threading.Thread(target=read_stages, args=(process, stages), daemon=True)
+            reader.start()
+            gave_way = False
+            while process.poll() is None:
+                if cancel.wait(CANCEL_POLL_PERIOD):
+                    logging.info(f'Track {self.id}: update superseded, terminating control.py')
+                    process.terminate()
+                    process.wait()
+                    return False
+                if 'sent' in stages and self.device_lock.contended():
+                    # Units move on their own, another track must not wait for our mechanics
+                    logging.info(f'Track {self.id}: device needed, not waiting for units')
+                    process.terminate()
+                    process.wait()
+                    gave_way = True
+            reader.join()
+        self.record_stages(spawned, stages, train)
+
+        if process.returncode == CONTROL_TIMEOUT_STATUS:
+            logging.warning(f'Track {self.id}: units not in place in time')
+        elif process.returncode != 0 and not gave_way:
+            logging.error(f'Track {self.id}: control.py returned nonzero status!')
+            return False
+        logging.info(f'Track {self.id}: done')
+        return True
+
+    def record_stages(self, spawned: float, stages: Dict[str, float],
+                      train: Optional[str]) -> None:
+        previous = spawned
+        for stage, span_name in CONTROL_STAGES:
+            if stage not in stages:
+                break
+            metrics.record(span_name, self.id, stages[stage]-previous, train)
+            previous = stages[stage]
+
+    def block_state(self, block_id: int) -> Dict:
+        def load() -> Dict:
+            with metrics.span('pt_block', self.id):
+                return utils.blocks.state(block_id)
+        return cache.block(block_id, load)
+
+    def desired_content(self) -> Optional[Dict]:
+        with metrics.span('compute', self.id):
+            return self._desired_content()
+
+    def _desired_content(self) -> Optional[Dict]:
+        # None = keep board as is, {} = empty board; self.train = train of the content
+        self.train = None
+        # Both block states are usually cached, fetch them concurrently when they are not
+        enable_future = pt_pool.submit(self.block_state, self.enable_block)
+        block_future = pt_pool.submit(self.block_state, self.id)
+        enabled = enable_future.result().get('activeOutput', False)
+        if not enabled:
+            logging.info(f'Track {self.id}: enable block disabled.')
+            return None
+
+        block = block_future.result()
+        trains = block.get('trains', [])
+        predict = block.get('trainPredict', '')
+        train = None
+
+        if trains:
+            with metrics.span('pt_train', self.id, trains[0]):
+                train = self.load_train(trains[0])
+            if predict != '':
+                pt_pool.submit(self.load_train, predict)  # likely needed soon
+        elif predict != '':
+            with metrics.span('pt_train', self.id, predict):
+                train = self.load_train(predict)
+
+        if train is None:
+            return self.preroll_content(None) if not trains else {}
+        content = self.train_content(train)
+        if content is None:
+            logging.info(f'Track {self.id}: train not shown.')
+            return self.preroll_content(train) if not trains else {}
+        self.train = train['name']
+        return content
+
+    def load_train(self, train_id: str) -> Dict:
+        train = cache.train(train_id)
+        if schedule is not None:
+            schedule.observe(train)
+        return train
+
+    def preroll_content(self, predicted: Optional[Dict]) -> Dict:
+        # Board would be blank: show part of predicted or upcoming departure to move units early.
+        # Units show the departure, so only announced ones unless --preroll-unannounced;
+        # when the predicted train is not announced, the next announced departure is used.
+        if schedule is None:
+            return {}
+        candidates = [predicted] if predicted is not None else []
+        for train in candidates + schedule.upcoming(self.id):
+            content = self.train_content(train, announced_only=not preroll_unannounced)
+            if content is not None:
+                logging.info(f'Track {self.id}: pre-rolling {train["name"]}')
+                self.train = train['name']
+                return {key: content[key] for key in PREROLL_KEYS if key in content}
+        return {}
+
+
+device_locks: Dict[str, DeviceLock] = {}
+schedule: Optional[Schedule] = None
+preroll_unannounced = False
+tracks: List[Track] = []
+# block id -> handlers, single callback registered for each block in hJOP client
+block_handlers: Dict[int, List[Callable[[], None]]] = {}
+
+
+def read_stages(process: subprocess.Popen, stages: Dict[str, float]) -> None:
+    # Notes time of each {"stage": ...} line printed by control.py --stages
+    assert process.stdout is not None
+    for line in process.stdout:
+        try:
+            stages[json.loads(line)['stage']] = time.monotonic()
+        except (ValueError, KeyError, TypeError):
+            logging.debug(f'control.py: {line.rstrip()}')
+
+
+def block_change_handler(block_id: int) -> Callable[[Dict], None]:
+    def on_change(block: Dict) -> None:
+        cache.update_block(block_id, block)
+        if any(track.id == block_id for track in tracks):
+            cache.invalidate_trains()
+        for handler in block_handlers[block_id]:
+            handler()
+    return on_change
+
+
+def load_tracks(args: Dict) -> List[Dict]:
+    if args['--config']:
+        with open(args['--config']) as f:
+            return json.load(f)['boards']
+    return [{'track': int(args['<track_id>'])}]
 
 
 @events.on_connect
 def on_connect():
-    global track_id
-    track_id = int(args['<track_id>'])
-    ac.blocks.register_change(on_track_change, track_id)
-    ac.blocks.register_change(on_enable_change, ENABLE_BLOCK_ID)
-    on_track_change(pt.get(f'/blocks/{track_id}?state=true')['block'])
+    cache.clear()
+    if schedule is not None:
+        schedule.clear()
+    for block_id in block_handlers:
+        ac.blocks.register_change(block_change_handler(block_id), block_id)
+    pt_pool.submit(startup)
+    logging.info('Startup sequence started')
+
+
+def startup() -> None:
+    areas = pt_pool.submit(cache.prefetch_areas)
+    try:
+        for track in tracks:
+            cache.update_block(track.id, pt.get(f'/blocks/{track.id}?state=true')['block'])
+            track.updater.request()
+        areas.result()
+    except Exception as e:
+        logging.warning(f'Startup request failed: {e}')
     logging.info('Startup sequence finished')
 
 
@@ -155,4 +346,22 @@ if __name__ == '__main__':
         datefmt='%Y-%m-%d %H:%M:%S',
     )
 
+    if int(args['-m']) > 0:
+        metrics.serve(int(args['-m']))
+    if float(args['--metrics-log']) > 0:
+        metrics.log_periodically(float(args['--metrics-log']))
+
+    configs = load_tracks(args)
+    if float(args['--lookahead']) > 0:
+        schedule = Schedule(datetime.timedelta(minutes=float(args['--lookahead'])),
+                            [int(config['track']) for config in configs])
+    preroll_unannounced = args['--preroll-unannounced']
+
+    for config in configs:
+        track = Track(config, int(args['-d'])/1000)
+        tracks.append(track)
+        block_handlers.setdefault(track.id, []).append(track.updater.request)
+        block_handlers.setdefault(track.enable_block, []).append(track.updater.request)
+    logging.info(f'Serving tracks {[track.id for track in tracks]}')
+
     panel_client.init(args['-s'], int(args['-p']))
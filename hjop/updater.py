@@ -0,0 +1,65 @@
+# edulint: flake8=--max-line-length=100
+
+"""
+Latest-wins board update queue
+
+Events only mark the board as outdated. A worker waits until no event came
+for the debounce window, computes desired content and applies it. A newer
+event cancels an update in progress, content already shown is not sent again.
+"""
+
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+# compute() returns desired content ({} = empty board) or None to keep the board as is
+ComputeFunc = Callable[[], Optional[Dict[str, Any]]]
+# apply(content, cancel) returns True iff content was shown, should abort when cancel is set
+ApplyFunc = Callable[[Dict[str, Any], threading.Event], bool]
+
+
+class Updater:
+    def __init__(self, compute: ComputeFunc, apply: ApplyFunc, debounce: float,
+                 name: str = 'updater'):
+        self.compute = compute
+        self.apply = apply
+        self.debounce = debounce
+        self.cond = threading.Condition()
+        self.requested_at: Optional[float] = None
+        self.cancel = threading.Event()
+        self.shown: Optional[Dict[str, Any]] = None
+        threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def request(self) -> None:
+        with self.cond:
+            self.requested_at = time.monotonic()
+            self.cancel.set()  # supersede update in progress
+            self.cond.notify()
+
+    def _wait_request(self) -> None:
+        with self.cond:
+            while self.requested_at is None:
+                self.cond.wait()
+            while True:
+                remaining = self.requested_at + self.debounce - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            self.requested_at = None
+            self.cancel.clear()
+
+    def _run(self) -> None:
+        while True:
+            self._wait_request()
+            try:
+                content = self.compute()
+                if content is None or self.cancel.is_set():
+                    continue
+                if content == self.shown:
+                    logging.info('Board already shows desired content')
+                    continue
+                self.shown = content if self.apply(content, self.cancel) else None
+            except Exception:
+                logging.exception('Board update failed')
+                self.shown = None
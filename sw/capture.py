@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# edulint: flake8=--max-line-length=100
+
+"""
+Binary capture & replay of serial traffic of Solari di Udine platform board
+
+Capture file: header '<4sB3x' (magic, version), then records '<dBH' (unix
+time, direction 0 = received / 1 = sent, length) each followed by raw bytes.
+Each record holds one frame (bytes between frames form records of their own).
+Files are rotated by size (<capture>.1 is the newest rotated one). Processes
+holding the port capture with --capture (control.py, solarid.py), record
+captures a port nobody else uses. Replay feeds received bytes through
+control.py framing & parse(), at recorded speed or as fast as possible, and
+prints JSON summary.
+
+Usage:
+    capture.py record [options] <device> <capture>
+    capture.py replay [options] <capture>...
+    capture.py (-h | --help)
+
+Options:
+  -l <loglevel>     Specify loglevel (python logging package) [default: info]
+  --max-size=<MB>   Rotate capture file when it reaches <MB> [default: 16]
+  --keep=<n>        Number of rotated capture files kept [default: 5]
+  --speed=<factor>  Replay speed relative to recording, 0 = as fast as possible [default: 0]
+  -p --pos          Print replayed positions as bytes
+  -s --sens         Print replayed sensor status as bits
+  -t --target       Print replayed target as bytes
+
+Replay rotated files oldest first, e.g. capture.py replay board.cap.2 board.cap.1 board.cap
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import atexit
+import signal
+import struct
+import logging
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+import docopt
+
+import protocol
+
+MAGIC = b'SOLC'
+VERSION = 1
+HEADER = struct.Struct('<4sB3x')
+RECORD = struct.Struct('<dBH')
+RECEIVED = 0
+SENT = 1
+
+MAX_SIZE = 16 * 1024 * 1024  # bytes
+KEEP = 5
+FLUSH_PERIOD = 1.0  # seconds
+
+
+class Capture:
+    """Appends timestamped chunks to capture file, rotates it by size. Thread-safe."""
+
+    def __init__(self, filename: str, max_size: int = MAX_SIZE, keep: int = KEEP):
+        self.filename = filename
+        self.max_size = max_size
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.open()
+        atexit.register(self.close)  # programs end with sys.exit()
+
+    def open(self) -> None:
+        self.file = open(self.filename, 'ab')
+        self.size = self.file.tell()
+        if self.size == 0:
+            self.file.write(HEADER.pack(MAGIC, VERSION))
+            self.file.flush()
+            self.size = HEADER.size
+
+    def rotate(self) -> None:
+        self.file.close()
+        for i in range(self.keep-1, 0, -1):
+            if os.path.exists(f'{self.filename}.{i}'):
+                os.replace(f'{self.filename}.{i}', f'{self.filename}.{i+1}')
+        if self.keep > 0:
+            os.replace(self.filename, f'{self.filename}.1')
+        else:
+            os.unlink(self.filename)
+        self.open()
+
+    def write(self, direction: int, data: bytes, timestamp: Optional[float] = None) -> None:
+        now = time.time() if timestamp is None else timestamp
+        with self.lock:
+            if self.size + RECORD.size + len(data) > self.max_size:
+                self.rotate()
+            self.file.write(RECORD.pack(now, direction, len(data)))
+            self.file.write(data)
+            self.size += RECORD.size + len(data)
+            if time.monotonic() - self.last_flush > FLUSH_PERIOD:
+                self.file.flush()
+                self.last_flush = time.monotonic()
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
+
+
+class CapturingPort:
+    """Serial port wrapper capturing all bytes read & written.
+
+    Reads often return a byte or two, so received bytes are buffered until a frame is complete.
+    Partial frame is written as is when no byte follows within receive timeout (replay resets
+    decoder the same way), the one pending at exit is lost.
+    """
+
+    def __init__(self, port, capture: Capture):
+        self.port = port
+        self.capture = capture
+        self.pending = bytearray()
+        self.last_received = 0.0  # unix time
+
+    def read(self, size: int = 1) -> bytes:
+        data = self.port.read(size)
+        if data:
+            self.received(data)
+        return data
+
+    def received(self, data: bytes) -> None:
+        now = time.time()
+        if self.pending and now-self.last_received > protocol.RECEIVE_TIMEOUT.total_seconds():
+            self.capture.write(RECEIVED, bytes(self.pending), self.last_received)
+            self.pending.clear()
+        self.last_received = now
+        self.pending += data
+
+        pending = self.pending
+        while pending:
+            if pending[0] != protocol.UART_RECEIVE_MAGIC:
+                end = pending.find(protocol.UART_RECEIVE_MAGIC)
+                end = len(pending) if end < 0 else end
+            elif len(pending) >= 2 and len(pending) >= pending[1] + 4:
+                end = pending[1] + 4
+            else:
+                break  # frame not complete yet
+            self.capture.write(RECEIVED, bytes(pending[:end]), now)
+            del pending[:end]
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.capture.write(SENT, data)
+        return self.port.write(data)
+
+    def __getattr__(self, name: str):
+        return getattr(self.port, name)
+
+
+def records(mm: mmap.mmap) -> Iterator[Tuple[float, int, memoryview]]:
+    # Yielded data are valid until the next record is yielded
+    magic, version = HEADER.unpack_from(mm)
+    assert magic == MAGIC and version == VERSION, 'Not a capture file of this version'
+    offset = HEADER.size
+    with memoryview(mm) as view:
+        while offset + RECORD.size <= len(mm):
+            timestamp, direction, length = RECORD.unpack_from(mm, offset)
+            offset += RECORD.size
+            if offset + length > len(mm):
+                logging.warning('Truncated last record')
+                break
+            with view[offset:offset+length] as data:
+                yield timestamp, direction, data
+            offset += length
+
+
+def received_stream(filename: str) -> bytes:
+    # All received bytes of a capture, e.g. as benchmark input
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return b''.join(bytes(data) for _, direction, data in records(mm)
+                        if direction == RECEIVED)
+
+
+class Counter:
+    """Program for control.parse counting decoded frames."""
+
+    def __init__(self):
+        self.frames: Dict[str, int] = {'pos': 0, 'target': 0, 'sens': 0}
+
+    def received_positions(self, *args) -> None:
+        self.frames['pos'] += 1
+
+    def received_target(self, *args) -> None:
+        self.frames['target'] += 1
+
+    def received_sensors(self, *args) -> None:
+        self.frames['sens'] += 1
+
+
+def replay(filenames: List[str], speed: float) -> Dict:
+    import control  # control.py imports this module when capturing
+    decoder = protocol.FrameDecoder()
+    counter = Counter()
+    received = sent = count = 0
+    first = last = None
+    started = time.monotonic()
+
+    for filename in filenames:
+        if os.path.getsize(filename) < HEADER.size:
+            logging.warning(f'{filename}: empty, skipping')
+            continue
+        with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for timestamp, direction, data in records(mm):
+                if first is None:
+                    first = timestamp
+                last = timestamp
+                count += 1
+                if speed > 0:
+                    delay = started + (timestamp-first)/speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                if direction == SENT:
+                    sent += len(data)
+                    logging.debug(f'< Sent: {list(data)}')
+                    continue
+                received += len(data)
+                for frame in decoder.feed(data, now=timestamp):
+                    control.parse(frame, counter)
+
+    elapsed = time.monotonic() - started
+    return {
+        'files': filenames,
+        'records': count,
+        'recorded_seconds': round((last or 0) - (first or 0), 3),
+        'replay_seconds': round(elapsed, 3),
+        'bytes_received': received,
+        'bytes_sent': sent,
+        'mb_per_second': round(received/elapsed/1024/1024, 3) if elapsed > 0 else 0,
+        'frames': counter.frames,
+        'discarded_bytes': decoder.discarded,
+        'xor_errors': decoder.xor_errors,
+        'timeout_resets': decoder.timeouts,
+    }
+
+
+def record(device: str, capture: Capture) -> None:
+    import serial
+    sport = CapturingPort(serial.Serial(device, 115200, exclusive=True), capture)
+    logging.info(f'Capturing {device} to {capture.filename}...')
+    while True:
+        if not sport.read(max(sport.in_waiting, 1)):
+            return  # port interrupt
+
+
+###############################################################################
+# Main
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+
+    loglevel = {
+        'debug': logging.DEBUG,
+        'info': logging.INFO,
+        'warning': logging.WARNING,
+        'error': logging.ERROR,
+        'critical': logging.CRITICAL,
+    }.get(args['-l'], logging.INFO)
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=loglevel,
+        format='[%(asctime)s.%(msecs)03d] %(levelname)s %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+
+    if args['replay']:
+        import control
+        control.args.update({key: args[key] for key in ['--pos', '--sens', '--target']})
+        print(json.dumps(replay(args['<capture>'], float(args['--speed'])), indent='    '))
+        sys.exit(0)
+
+    capture = Capture(args['<capture>'][0], int(float(args['--max-size'])*1024*1024),
+                      int(args['--keep']))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        record(args['<device>'], capture)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        capture.close()
@@ -9,7 +9,13 @@ Usage:
     control.py reset [options] [-w|--wait] <device> <side>
     control.py flap [options] <device> <flapid> <side>
     control.py loop [options] <device> [<side>]
-    control.py state [options] [--file=<filename.json>] <device> <side>
+    control.py state [options] [--cached] [--file=<filename.json>] <device> <side>
+    control.py estimate [options] [--file=<filename.json>] <device> <side>
+    control.py stream [options] <device>
+    control.py compile-timetable [options] <timetable> <output.bin>
+    control.py play [options] <timetable.bin> <track> <device> <side>
+    control.py clock [options] [--countdown=<time>] <device> <side>
+    control.py linkbench [options] [--file=<filename.json>] <device>
     control.py (-h | --help)
     control.py --version
 
@@ -18,141 +24,65 @@ Options:
   -p --pos          Print received positions as bytes
   -s --sens         Print received sensor status as bits
   -t --target       Print received target as bytes
-
-Side: A/B
+  -f --full         Always send all positions, even units already in place
+  --timeout=<s>     Timeout of -w in seconds, 'auto' derives it from estimate [default: auto]
+  --counts=<filename.json>  Load & store learned number of flaps of units
+  --interval=<s>    Minimal time between loop events of a side, changes are merged [default: 0]
+  --state-file=<path>  Shared state cache kept while port is open, 'none' = off [default: auto]
+  --cached          Read state from state cache if not older than --max-age, query board otherwise
+  --max-age=<s>     Maximal age of cached state [default: 2]
+  --countdown=<time>  Show minutes left to <time> (H:MM) on delay unit
+  --lead=<s>        Start clock moves <s> earlier than estimated [default: 0]
+  --requests=<n>    Number of requests of each type sent by linkbench [default: 100]
+  --capture=<file>  Write all serial traffic to rotated binary capture (see capture.py)
+  --stages          Print NDJSON progress of set_positions/reset to stdout, log to stderr
+
+Side: A/B, AB/both for both sides at once (set_positions, reset, flap)
 
 See content.json for set_positions example
+state file defaults to solari-<device name>.state in /run/solari (see statefile.py)
+estimate prints expected movement time in seconds from current positions to content
+loop prints NDJSON event whenever state of a side changes (see Loop)
+stream applies NDJSON commands from stdin in order, prints NDJSON result of each (see Stream)
+set_positions/reset with --stages print {"stage": ...} when board state is known (synced),
+all frames are sent (sent) and, with -w, when positions are reached (reached)
+compile-timetable validates & encodes day of departures (JSON/CSV, see timetable.py),
+play shows departures of <track> from compiled timetable
+clock shows current time, only time units (and delay unit with --countdown) are moved
+linkbench measures request latency, frame rates & link errors, prints JSON report
 """
 
 import serial
 import sys
 import datetime
-from typing import List, Dict
+import time
+import queue
+import threading
+from typing import List, Dict, Any, Optional, Set, Tuple, Sequence
 import json
 import docopt
 import logging
 
-APP_VERSION = '1.0'
-
-UART_RECEIVE_MAGIC = 0xB7
-UART_SEND_MAGIC = 0xCA
-
-UART_MSG_MS_GET_SENS = 0x01
-UART_MSG_MS_GET_POS = 0x02
-UART_MSG_MS_GET_TARGET = 0x03
-UART_MSG_MS_FLAP = 0x10
-UART_MSG_MS_SET_SINGLE = 0x11
-UART_MSG_MS_SET_ALL = 0x12
-
-UART_MSG_SM_SENS = 0x01
-UART_MSG_SM_POS = 0x02
-UART_MSG_SM_TARGET = 0x03
-
-RECEIVE_TIMEOUT = datetime.timedelta(milliseconds=200)
-
-FLAP_UNITS = 26
-FLAP_ALPHABET = ' 0123456789aáäbcčdďeéěfghiíjklmnňoóöpqrřsštťuúůüvwxyýzž/.-()'
-FLAP_FINAL_LEN = 14
-FLAP_TRAINNUM_COUNT = 5
-
-FLAP_TYPES = [
-    'Ec', 'Ic', 'Ex R', 'Ex lůžkový', 'Ex', 'R R', 'R lůžkový', 'R', 'Sp', 'Os',
-    'Mim. Ex', 'Mim. R', 'Mim. Sp', 'Mim. Os', 'Zvláštní vlak', 'Special train',
-    'Parní vlak', 'Steam train', 'IR', 'ICE', 'Sc', 'TGV', '', 'Ic bílá', 'Sp',
-]
-
-FLAP_DIRECTIONS_1 = [
-    'Adamov', 'Adamov-Blansko', 'Bylnice', 'Blansko', 'Blažovice', 'Bohumín',
-    'Břeclav', 'Břeclav-Kúty', 'Břeclav-Bratislava', 'Bučovice', 'Bzenec',
-    'Česká Třebová', 'Č.Třebová-Pardubice', 'Havlíčkův Brod', 'Holubice',
-    'Horní Cerekev', 'Hradec Králové', 'Jihlava', 'Jihlava-Horní Cerekev',
-    'Kolín', 'Kojetín', 'Kroměříž', 'Křižanov', 'Kunovice', 'Kuřim', 'Kuřim-Tišnov',
-    'Kyjov', 'Modřice', 'Moravské Bránice', 'Moravský Krumlov', 'Náměšť nad Oslavou',
-    'Nezamyslice', 'Olomouc hl.n.', 'Olomouc-Uničov', 'Ostrava hl.n.',
-    'Ostrava-Vítkovice', 'Pardubice hl.n.', 'Praha-Holešovice', 'Přerov',
-    'Přerov-Bohumín', 'Prostějov hl.n.', 'Prostějov-Olomouc', 'Rajhrad',
-    'Rousínov', 'Šakvice', 'Skalice nad Svitavou', 'Sokolnice-Teln.', 'Střelice',
-    'Studenec', 'Studénka', 'Tišnov', 'Veselí nad Moravou', 'Vranovice',
-    'Vyškov na Moravě', 'Zastávka u Brna', 'Žďár nad Sázavou', '?', 'Studenec',
-    'Štúrovo', 'Svitavy', 'Tábor', 'Tišnov', 'Tišnov-Křižanov', 'Trenč. Teplá',
-    'Turnov', 'Uherské Hradiště', '?'
-]
-
-FLAP_DIRECTIONS_2 = [
-    'Blansko', 'Bohumín', 'Bojkovice', 'Břeclav', 'Bratislava', 'Bylnice',
-    'Bučovice', 'Bzenec', 'Čadca', 'České Budějovice', 'Český Těšín', 'Chornice',
-    'Děčin', 'Frýdek-Místek', 'Havířov', 'Havlíčkův Brod', 'Holubice', 'Horní Cerekev',
-    'Hradec Králové', 'Hranice na Moravě', 'Hrušovany nad Jevišovkou', 'Hulín',
-    'Kolína', 'Komárno', 'Kyjov', 'Kyjov Bzenec', 'Křižanov', 'Kunovice', 'Kúty',
-    'Moravské Bránice', 'Moravský Krumlov', 'Moravský Písek', 'Moravská Třebová',
-    'Mosty u Jablunkova', 'Náměšť nad Oslavou', 'Nezamyslice', 'Nové Město na Moravě',
-    'Okříšky', 'Ostrava hl.n.', 'Ostrava-Svinov', 'Ostrava-Vítkovice', 'Pardubice hl.n.',
-    'Pardubice-Kolín', 'Praha-Holešovice', 'Přerov', 'S1', 'S2', 'S3', 'S4', 'S41',
-    'S5', 'S6', 'S7', 'R1', 'R2', 'R3', 'R4', 'R41', 'R5', 'R6', 'R7', 'Uničov',
-    'Ústí nad Labem', 'Valašské Meziřící', 'Veselí nad Lužnicí', 'Veseá nad Moravou',
-    'Vyškov na Moravě', 'Zábřeh na Moravě', 'Zaječí', 'Žďár nad Sázavou', 'Žilina',
-    'Kojetín', 'Vlárský Průsmyk', 'Tábor-Veselí nad Lužnicí', '', 'Praha hl.n.',
-    '', 'ODKLON']
-
-FLAP_DELAYS_MIN = [
-    5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 70, 80, 90, 100, 110,
-    120, 130, 140, 150, 160, 170, 180, 200, 220, 240, 260, 280, 300, 330, 360,
-    390, 420, 450, 480
-]
-
-FLAP_DELAYS_NEXT = [
-    '>480', 'VLAK NEJEDE', 'BUS'
-]
-
-
-def xor(data: List[int]) -> int:
-    result = 0
-    for num in data:
-        result ^= num
-    return result
-
-
-def send(sport, msgtype: int, data: List[int]) -> None:
-    _data = data[:]
-    _data.insert(0, msgtype)
-    _data.insert(0, len(data))
-    _data.insert(0, UART_SEND_MAGIC)
-    _data.append(xor(_data))
-
-    logging.debug(f'< Send: {_data}')
-    sport.write(_data)
-
-
-def flap_str(lst: List[str], i: int) -> str:
-    if i == 0xFF:
-        return '?'
-    return lst[i-1] if i > 0 and i <= len(lst) else ''
-
-
-def side_str(_side: int) -> str:
-    if (_side & 1) == 0:
-        return 'A'
-    if (_side & 1) == 1:
-        return 'B'
-    return '?'
+import estimate
+import statefile
+import timetable
+from protocol import UART_MSG_MS_GET_SENS, UART_MSG_MS_GET_POS, UART_MSG_MS_GET_TARGET, \
+    UART_MSG_MS_FLAP, UART_MSG_MS_SET_SINGLE, UART_MSG_SM_SENS, UART_MSG_SM_POS, \
+    UART_MSG_SM_TARGET, FLAP_UNITS, UNIT_HOURS, UNIT_MINUTES_TENTHS, UNIT_MINUTES_ONES, \
+    UNIT_DELAY, send, send_spaced, side_str, sides_int, FrameDecoder, encoder, flap_delay, \
+    flap_all_positions, plan_update, PositionFrame, explain_positions, SideState
 
+APP_VERSION = '1.0'
 
-def side_int(_side: str) -> int:
-    _side = _side.lower()
-    if _side == 'a':
-        return 0
-    if _side == 'b':
-        return 1
-
-    assert False, 'Invalid side'
-
+# Replaced by docopt arguments when run as a script, defaults apply when imported as a module
+args: Dict[str, Any] = {'<sides>': None, '--pos': False, '--sens': False, '--target': False}
+# Updated with every received frame when set (by process holding the port)
+state_file: Optional['statefile.StateFile'] = None
 
-def parse(data: List[int], program) -> None:
-    if xor(data) != 0:
-        logging.warning(f'Invalid xor: {data}')
-        return
 
-    logging.debug(f'> Received: {data}')
+def parse(data: memoryview, program) -> None:
+    if logging.root.isEnabledFor(logging.DEBUG):
+        logging.debug(f'> Received: {list(data)}')
 
     if len(data) < 5:
         logging.warning('Data too short!')
@@ -163,9 +93,11 @@ def parse(data: List[int], program) -> None:
         target_reached = bool((data[3] >> 1) & 1)
         target_reached_ignore_error = bool((data[3] >> 2) & 1)
         fault = not target_reached and target_reached_ignore_error
-        positions = data[4:-1]
+        positions = PositionFrame(data[4:-1])
         assert len(positions) == FLAP_UNITS, f'{len(positions)} != {FLAP_UNITS}'
-        if args['<side>'] is None or side == args['<side>']:
+        if state_file is not None:
+            state_file.positions(side, positions, target_reached, fault)
+        if args['<sides>'] is None or side in args['<sides>']:
             if args['--pos']:
                 logging.info(f'Side: {side_str(side)} Positions: {positions}')
             if getattr(program, 'received_positions', None):
@@ -175,9 +107,11 @@ def parse(data: List[int], program) -> None:
 
     elif data[2] == UART_MSG_SM_TARGET:
         side = data[3] & 1
-        target = data[4:-1]
+        target = PositionFrame(data[4:-1])
         assert len(target) == FLAP_UNITS, f'{len(target)} != {FLAP_UNITS}'
-        if args['<side>'] is None or side == args['<side>']:
+        if state_file is not None:
+            state_file.target(side, target)
+        if args['<sides>'] is None or side in args['<sides>']:
             if args['--target']:
                 logging.info(f'Side: {side_str(side)} Target: {target}')
             if getattr(program, 'received_target', None):
@@ -187,8 +121,10 @@ def parse(data: List[int], program) -> None:
 
     elif data[2] == UART_MSG_SM_SENS:
         side = data[3] & 1
-        sensors = data[4:-1]
-        if args['<side>'] is None or side == args['<side>']:
+        sensors = list(data[4:-1])
+        if state_file is not None:
+            state_file.sensors(side, sensors)
+        if args['<sides>'] is None or side in args['<sides>']:
             if args['--sens']:
                 logging.info(f'Side: {side_str(side)} Sensors: ' +
                              (' '.join([f'{byte:#010b}' for byte in sensors])))
@@ -198,211 +134,219 @@ def parse(data: List[int], program) -> None:
             logging.debug('Side mismatch')
 
 
-def flap_number(num: int, length: int) -> List[int]:  # always returns list of length `length`
-    if num == 0:
-        return [0]*length
-    numstr = str(num).rjust(length, '~')[-length:]
-    return [int(char)+1 if char != '~' else 0 for char in numstr]
-
-
-def flap_final(final: str) -> List[int]:  # always returns list of length FLAP_FINAL_LEN
-    for letter in final.lower():
-        assert letter in FLAP_ALPHABET, f'Letter "{letter}" is not available!'
-    return [FLAP_ALPHABET.index(char) for char in final.lower().ljust(FLAP_FINAL_LEN, ' ')]
-
-
-def flap_delay(delay: str) -> int:
-    if delay.upper() in FLAP_DELAYS_NEXT:
-        return FLAP_DELAYS_NEXT.index(delay.upper()) + len(FLAP_DELAYS_MIN) + 1
-
-    if ':' in delay:
-        hours, minutes = map(int, delay.split(':'))
-        minutes += hours*60
-    elif delay.isdecimal():
-        minutes = int(delay)
-    else:
-        assert False, 'Invalid delay'
-
-    if minutes > 480:
-        return len(FLAP_DELAYS_MIN) + 1
-
-    # Pick nearest lower delay
-    while minutes > 0 and minutes not in FLAP_DELAYS_MIN:
-        minutes -= 1
-
-    if minutes not in FLAP_DELAYS_MIN:
-        return 0
-
-    return FLAP_DELAYS_MIN.index(minutes) + 1
-
-
-def flap_all_positions(content: Dict) -> List[int]:  # always returns list of length FLAP_UNITS
-    final_str = content.get('final', '')
-    if len(final_str) > FLAP_FINAL_LEN:
-        final_str = final_str[:FLAP_FINAL_LEN-1] + '.'
-    final = flap_final(final_str)
-    assert len(final) == FLAP_FINAL_LEN, f'Invalid length: {len(final)}!'
-
-    hours, minutes = map(int, content['time'].split(':')) if 'time' in content else (0xFF, 0xFF)
-
-    result = []
-    result += [FLAP_TYPES.index(content['type'])+1] if 'type' in content else [0]
-    trainnum = flap_number(content.get('num', 0), FLAP_TRAINNUM_COUNT)
-    if content.get('num_red', False):
-        trainnum = [v+10 if v != 0 else 0 for v in trainnum]
-    result += trainnum
-    result += final[0:2]
-    result += final[10:14]
-    result += [FLAP_DIRECTIONS_1.index(content['direction1'])+1] if 'direction1' in content else [0]
-    result += [FLAP_DIRECTIONS_2.index(content['direction2'])+1] if 'direction2' in content else [0]
-    result += [hours+1] if hours != 0xFF else [0]
-    result += [(minutes//10)+1] if minutes != 0xFF else [0]
-    result += final[2:10]  # 0x10-0x17
-    result += [(minutes % 10) + 1] if minutes != 0xFF else [0]
-    result += [flap_delay(content['delay'])] if 'delay' in content else [0]
-
-    assert len(result) == FLAP_UNITS
-    return result
-
-
-def explain_positions(data: List[int]) -> Dict:
-    assert len(data) >= FLAP_UNITS
-    if len(data) > FLAP_UNITS:
-        logging.warning(f'{len(data)} bytes of positions received, however {FLAP_UNITS} expected!')
-    result = {}
-    result['raw'] = {}
-
-    result['type'] = flap_str(FLAP_TYPES, data[0])
-    result['raw']['type'] = data[0]
-
-    num_data = data[1:6]
-    trainnum = 0
-    for i, numeral in enumerate(num_data):
-        if numeral == 0:
-            numeral = 1
-        trainnum += (10**(len(num_data)-i-1)) * ((numeral-1) % 10)
-    if any(num > 0 for num in num_data):
-        result['num'] = trainnum
-        result['num_red'] = any(num > 10 for num in num_data)
-
-    result['raw']['num'] = num_data
-
-    result['direction1'] = flap_str(FLAP_DIRECTIONS_1, data[12])
-    result['raw']['direction1'] = data[12]
-    result['direction2'] = flap_str(FLAP_DIRECTIONS_2, data[13])
-    result['raw']['direction2'] = data[13]
-
-    delay = data[25]
-    if delay == 0xFF:
-        result['delay'] = '?'
-    elif delay > 0:
-        delay_i = delay-1
-        if delay_i < len(FLAP_DELAYS_MIN):
-            minutes = FLAP_DELAYS_MIN[delay_i]
-            result['delay'] = f'{minutes//60}:{str(minutes%60).zfill(2)}'
-        elif delay_i < len(FLAP_DELAYS_MIN) + len(FLAP_DELAYS_NEXT):
-            result['delay'] = FLAP_DELAYS_NEXT[delay_i-len(FLAP_DELAYS_MIN)]
-        else:
-            result['delay'] = ''
-    else:
-        result['delay'] = ''
-    result['raw']['delay'] = delay
-
-    hours, minutes_tenths, minutes_ones = data[14], data[15], data[24]
-    if hours > 24 or minutes_tenths > 10 or minutes_ones > 10:
-        result['time'] = '?'
-    elif hours == 0 or minutes_tenths == 0 or minutes_ones == 0:
-        result['time'] = ''
-    else:
-        minutes = (minutes_tenths-1)*10 + (minutes_ones-1)
-        result['time'] = f'{hours-1}:{str(minutes).zfill(2)}'
-    result['raw']['time'] = {}
-    result['raw']['time']['minutes_ones'] = minutes_ones
-    result['raw']['time']['minutes_tenths'] = minutes_tenths
-    result['raw']['time']['hours'] = hours
-
-    final = data[6:8] + data[16:24] + data[8:12]
-    result['final'] = ''.join(flap_str(FLAP_ALPHABET, min(f+1, 0xFF)) for f in final)
-    result['raw']['final'] = final
+def receive_loop(sport, program) -> None:  # returns on port interrupt
+    decoder = getattr(program, 'decoder', None) or FrameDecoder()
+    while True:
+        received = sport.read(max(sport.in_waiting, 1))
+        if not received:
+            return  # port interrupt
+        for frame in decoder.feed(received):
+            parse(frame, program)
 
-    return result
+        if getattr(program, 'iter', None):
+            program.iter()
 
 
 ###############################################################################
 # Subprograms
 
+def read_content() -> Dict:
+    if args['--file']:
+        with open(args['--file']) as f:
+            return json.loads(f.read())
+    if args['set_positions'] or args['estimate']:
+        return json.loads(input())
+    return {}
+
+
 class SetPositions:
     def __init__(self, sport):
         self.sport = sport
-        self.positions_sent = False
-        self.sent_positions = []
-
-        self.content = {}
-        if args['--file']:
-            with open(args['--file']) as f:
-                self.content = json.loads(f.read())
-        elif args['set_positions']:
-            self.content = json.loads(input())
-
-    def received_positions(self, positions: List[int], side: int, target_reached: bool, fault: bool) -> None:
-        if not self.positions_sent and all([pos != 0xFF for pos in positions]):
-            self.positions_sent = True
-            self.sent_positions = flap_all_positions(self.content)
-            logging.info(f'Sending positions: {self.sent_positions} ...')
-            send(self.sport, UART_MSG_MS_SET_ALL, [args['<side>']] + self.sent_positions)
+        self.requested: Dict[int, Sequence[int]] = {}  # side -> positions when requested
+        self.sent_positions: Dict[int, List[int]] = {}
+        self.current: Dict[int, Sequence[int]] = {}
+        self.reached: Set[int] = set()
+        self.counts = estimate.FlapCounts(args['--counts'])
+        self.started = time.monotonic()
+        self.predicted: Optional[estimate.Estimate] = None
+        self.deadline: Optional[float] = None
+
+        self.content = read_content()
+        self.positions = flap_all_positions(self.content)
+
+    def finish(self, code: int = 0) -> None:
+        self.counts.save()
+        sys.exit(code)
+
+    @staticmethod
+    def stage(name: str) -> None:
+        if args['--stages']:
+            print(json.dumps({'stage': name}), flush=True)
+
+    def received_positions(self, positions: PositionFrame, side: int, target_reached: bool,
+                           fault: bool) -> None:
+        self.counts.observe(side, positions)
+        self.current[side] = positions
+        if side not in self.requested and positions.initialized():
+            self.requested[side] = positions
+            if args['--full']:
+                self.update(side, None)
+            else:
+                send_spaced(self.sport, UART_MSG_MS_GET_TARGET, [])
+
+        if positions == self.sent_positions.get(side):
+            self.reached.add(side)
+        if len(self.reached) == len(args['<sides>']):
+            self.stage('reached')
+            if self.predicted is not None:
+                logging.info(f'Finished in {time.monotonic()-self.started:.1f} s '
+                             f'(predicted {self.predicted.total:.1f} s)')
+            else:
+                logging.info('Finished')
+            self.finish()
+
+    def iter(self) -> None:
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            for side, positions in self.sent_positions.items():
+                stuck = [unit for unit, (cur, tgt) in enumerate(zip(self.current[side], positions))
+                         if cur != tgt]
+                if stuck:
+                    logging.error(f'Side {side_str(side)}: units not in place: {stuck}')
+            logging.error('Timeout!')
+            self.finish(2)
+
+    def received_target(self, target: PositionFrame, side: int) -> None:
+        if side in self.requested and side not in self.sent_positions:
+            self.update(side, target)
+
+    def update(self, side: int, target: Optional[Sequence[int]]) -> None:
+        if not self.sent_positions:
+            self.stage('synced')
+        positions = encoder.nearest(self.positions, self.requested[side], target)
+        self.sent_positions[side] = positions
+        messages = plan_update(side, target, positions)
+        if not messages:
+            logging.info(f'Side {side_str(side)}: positions already set')
+        for msgtype, data in messages:
+            logging.info(f'Side {side_str(side)}: sending {msgtype:#04x}: {data[1:]} ...')
+            send_spaced(self.sport, msgtype, data)
+
+        if len(self.sent_positions) == len(args['<sides>']):
+            self.stage('sent')
             if not args['-w']:
                 logging.info('Finished')
-                sys.exit(0)
+                self.finish()
             else:
-                logging.info('Waiting for positions reached (-w present)...')
-
-        if positions == self.sent_positions:
-            logging.info('Finished')
-            sys.exit(0)
+                self.started = time.monotonic()
+                self.predicted = estimate.estimate(self.requested, self.sent_positions, self.counts)
+                timeout = self.predicted.timeout() if args['--timeout'] == 'auto' \
+                    else float(args['--timeout'])
+                self.deadline = self.started + timeout
+                logging.info(f'Waiting for positions reached (-w present), predicted '
+                             f'{self.predicted.total:.1f} s, timeout {timeout:.1f} s...')
 
 
 class Flap:
     def __init__(self, sport):
         self.sport = sport
-        self.sent = False
+        self.sent: Set[int] = set()
+        self.confirmed: Set[int] = set()
         logging.info('Waiting for device initialized...')
 
-    def received_positions(self, positions: List[int], side: int, target_reached: bool, fault: bool) -> None:
-        if all([pos != 0xFF for pos in positions]) and not self.sent:
-            logging.info('Sending flap...')
-            send(self.sport, UART_MSG_MS_FLAP, [args['<side>'], int(args['<flapid>'])])
-            self.sent = True
-
-    def received_target(self, target: List[int], side: int) -> None:
-        if self.sent:
+    def received_positions(self, positions: PositionFrame, side: int, target_reached: bool,
+                           fault: bool) -> None:
+        if positions.initialized() and side not in self.sent:
+            logging.info(f'Side {side_str(side)}: sending flap...')
+            send_spaced(self.sport, UART_MSG_MS_FLAP, [side, int(args['<flapid>'])])
+            self.sent.add(side)
+
+    def received_target(self, target: PositionFrame, side: int) -> None:
+        if side in self.sent:
+            self.confirmed.add(side)
+        if len(self.confirmed) == len(args['<sides>']):
             logging.info('Flap sent.')
             sys.exit(0)
 
 
 class Loop:
+    """Monitors the board, prints compact NDJSON event when state of a side changes.
+
+    Event contains decoded positions and/or target with list of changed units, sensors when
+    they changed, current target_reached & fault flags and list of flags that changed. Changes
+    within --interval after previous event of the side are merged into the next event.
+    """
+
+    KEYS = ['positions', 'target', 'sensors', 'target_reached', 'fault']
+
     def __init__(self, sport):
-        pass
+        self.interval = float(args['--interval'])
+        self.current: Dict[int, Dict[str, Any]] = {side: {} for side in [0, 1]}
+        self.shown: Dict[int, Dict[str, Any]] = {side: {} for side in [0, 1]}  # in last event
+        self.last_event = {side: 0.0 for side in [0, 1]}
+        self.pending: Set[int] = set()
+        send(sport, UART_MSG_MS_GET_TARGET, [])
+
+    def received_positions(self, positions: PositionFrame, side: int, target_reached: bool,
+                           fault: bool) -> None:
+        self.update(side, positions=positions, target_reached=target_reached, fault=fault)
+
+    def received_target(self, target: PositionFrame, side: int) -> None:
+        self.update(side, target=target)
+
+    def received_sensors(self, sensors: List[int], side: int) -> None:
+        self.update(side, sensors=sensors)
+
+    def update(self, side: int, **values: Any) -> None:
+        current = self.current[side]
+        current.update(values)
+        if any(current[key] != self.shown[side].get(key) for key in values):
+            self.pending.add(side)
+
+    def iter(self) -> None:
+        now = time.monotonic()
+        for side in sorted(self.pending):
+            if now - self.last_event[side] >= self.interval:
+                self.emit(side)
+                self.last_event[side] = now
+                self.pending.remove(side)
+
+    def emit(self, side: int) -> None:
+        current, shown = self.current[side], self.shown[side]
+        event: Dict[str, Any] = {
+            'time': datetime.datetime.now().isoformat(timespec='milliseconds'),
+            'side': side_str(side),
+        }
+        for key in ['positions', 'target']:
+            if key in current and current[key] != shown.get(key):
+                event[key] = current[key].explain(raw=False)
+                event[key]['changed'] = current[key].diff(shown.get(key))
+        if 'sensors' in current and current['sensors'] != shown.get('sensors'):
+            event['sensors'] = current['sensors']
+        for key in ['target_reached', 'fault']:
+            if key in current:
+                event[key] = current[key]
+        event['transitions'] = [key for key in ['target_reached', 'fault']
+                                if key in shown and current.get(key) != shown[key]]
+
+        print(json.dumps(event, ensure_ascii=False, separators=(',', ':')), flush=True)
+        self.shown[side] = dict(current)
 
 
 class State:
     def __init__(self, sport):
         self.sport = sport
         self.received = {}
+        assert len(args['<sides>']) == 1, 'State can be read from single side only'
         logging.info('Waiting for positions...')
 
     def dump_and_exit(self) -> None:
-        content = json.dumps(self.received, ensure_ascii=False, indent='    ')
-        if args['--file']:
-            with open(args['--file'], 'w') as f:
-                f.write(content)
-        else:
-            print(content)
-
+        write_output(self.received)
         sys.exit(0)
 
-    def received_positions(self, positions: List[int], side: int, target_reached: bool, fault: bool) -> None:
+    def received_positions(self, positions: PositionFrame, side: int, target_reached: bool,
+                           fault: bool) -> None:
         logging.info('Positions received.')
-        if side == args['<side>']:
+        if side in args['<sides>']:
             self.received['current'] = explain_positions(positions)
             self.received['current']['side'] = side
             self.received['current']['target_reached'] = target_reached
@@ -413,7 +357,7 @@ class State:
             else:
                 send(self.sport, UART_MSG_MS_GET_TARGET, [])
 
-    def received_target(self, target: List[int], side: int) -> None:
+    def received_target(self, target: PositionFrame, side: int) -> None:
         self.received['target'] = explain_positions(target)
         self.received['target']['side'] = side
         logging.info('Target received.')
@@ -421,13 +365,526 @@ class State:
             self.dump_and_exit()
 
 
+def write_output(data: Dict) -> None:
+    content = json.dumps(data, ensure_ascii=False, indent='    ')
+    if args['--file']:
+        with open(args['--file'], 'w') as f:
+            f.write(content)
+    else:
+        print(content)
+
+
+def read_cached_state(filename: str, side: int, max_age: float) -> Optional[Dict]:
+    # Returns state in the same format as State does, None when not available or too old
+    try:
+        cache = statefile.StateFile(filename)
+    except (OSError, ValueError, AssertionError) as e:
+        logging.debug(f'State cache {filename} not available: {e}')
+        return None
+    cached = cache.read(side)
+    cache.close()
+    if cached is None or cached.target is None or cached.age() > max_age:
+        return None
+
+    result: Dict[str, Any] = {}
+    result['current'] = cached.positions.explain()
+    result['current']['side'] = side
+    result['current']['target_reached'] = cached.target_reached
+    result['current']['fault'] = cached.fault
+    result['target'] = cached.target.explain()
+    result['target']['side'] = side
+    result['age'] = round(cached.age(), 3)
+    return result
+
+
+class Estimate:
+    def __init__(self, sport):
+        self.counts = estimate.FlapCounts(args['--counts'])
+        self.current: Dict[int, Sequence[int]] = {}
+        self.positions = flap_all_positions(read_content())
+        logging.info('Waiting for positions...')
+
+    def received_positions(self, positions: PositionFrame, side: int, target_reached: bool,
+                           fault: bool) -> None:
+        if positions.initialized():
+            self.current[side] = positions
+        if len(self.current) == len(args['<sides>']):
+            targets = {side: encoder.nearest(self.positions, current)
+                       for side, current in self.current.items()}
+            result = estimate.estimate(self.current, targets, self.counts)
+            print(json.dumps(result.json(), indent='    '))
+            sys.exit(0)
+
+
+class Stream:
+    """Applies NDJSON commands read from stdin over a single serial session.
+
+    Commands (one JSON object per line, "side" defaults to AB, "id" is copied to result):
+      {"cmd": "set", "content": {...}, "wait": false, "full": false, "timeout": null}
+      {"cmd": "reset", "wait": false, "timeout": null}
+      {"cmd": "flap", "unit": 3}
+      {"cmd": "state"}
+      {"cmd": "wait", "timeout": null}  -- until positions reach target
+      {"cmd": "sleep", "seconds": 1.5}
+    Commands are applied in order, one result line is printed for each of them. Timeout 'null'
+    is derived from estimate for waiting, no limit otherwise. Invalid command is answered with
+    {"ok": false, "error": ...}, the session goes on.
+    """
+
+    # Raised by invalid commands, reported in the result line
+    COMMAND_ERRORS = (ValueError, AssertionError, KeyError, TypeError, AttributeError)
+
+    def __init__(self, sport):
+        self.sport = sport
+        self.sides = {side: SideState() for side in [0, 1]}
+        self.counts = estimate.FlapCounts(args['--counts'])
+        self.commands: queue.Queue[Optional[str]] = queue.Queue()
+        self.command: Optional[Dict[str, Any]] = None
+        self.started = 0.0
+        self.deadline: Optional[float] = None
+        self.waiting: Optional[Dict[int, List[int]]] = None  # side -> positions to be reached
+        self.result: Dict[str, Any] = {}
+        threading.Thread(target=self.read_commands, daemon=True).start()
+        send(self.sport, UART_MSG_MS_GET_TARGET, [])
+
+    def read_commands(self) -> None:
+        for line in sys.stdin:
+            if line.strip():
+                self.commands.put(line)
+        self.commands.put(None)
+
+    def received_positions(self, positions: PositionFrame, side: int, target_reached: bool,
+                           fault: bool) -> None:
+        self.counts.observe(side, positions)
+        state = self.sides[side]
+        state.positions = positions
+        state.target_reached = target_reached
+        state.fault = fault
+        state.updated = datetime.datetime.now()
+
+    def received_target(self, target: PositionFrame, side: int) -> None:
+        self.sides[side].target = target
+
+    def received_sensors(self, sensors: List[int], side: int) -> None:
+        self.sides[side].sensors = sensors
+
+    def iter(self) -> None:
+        while True:
+            if self.command is None:
+                try:
+                    line = self.commands.get_nowait()
+                except queue.Empty:
+                    return
+                if line is None:
+                    self.counts.save()
+                    sys.exit(0)
+                self.start(line)
+            elif not self.step():
+                return
+
+    def start(self, line: str) -> None:
+        self.started = time.monotonic()
+        self.waiting = None
+        self.result = {}
+        try:
+            command = json.loads(line)
+            assert isinstance(command, dict), 'Command must be JSON object'
+            if 'id' in command:
+                self.result['id'] = command['id']
+            self.result['cmd'] = command.get('cmd')
+            self.validate(command)
+            self.command = command
+            self.command['sides'] = sides_int(command.get('side', 'AB'))
+            timeout = command.get('timeout')
+            self.deadline = self.started + float(timeout) if timeout is not None else None
+        except self.COMMAND_ERRORS as e:
+            self.finish(str(e))
+
+    @staticmethod
+    def validate(command: Dict[str, Any]) -> None:
+        def number(value: Any) -> bool:
+            return isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+
+        assert isinstance(command.get('side', 'AB'), str), 'Side must be A, B or AB'
+        assert command.get('timeout') is None or number(command['timeout']), \
+            'Timeout must be non-negative number or null'
+        cmd = command.get('cmd')
+        if cmd == 'set':
+            assert isinstance(command.get('content', {}), dict), 'Content must be JSON object'
+        elif cmd == 'flap':
+            unit = command.get('unit')
+            assert isinstance(unit, int) and not isinstance(unit, bool) and \
+                0 <= unit < FLAP_UNITS, f'Unit must be 0..{FLAP_UNITS-1}'
+        elif cmd == 'sleep':
+            assert number(command.get('seconds', 0)), 'Seconds must be non-negative number'
+
+    def finish(self, error: Optional[str] = None) -> None:
+        self.result['ok'] = error is None
+        if error is not None:
+            self.result['error'] = error
+        self.result['elapsed'] = round(time.monotonic()-self.started, 3)
+        print(json.dumps(self.result, ensure_ascii=False), flush=True)
+        self.command = None
+
+    def step(self) -> bool:  # returns True iff current command finished
+        assert self.command is not None
+        try:
+            if self.waiting is not None:
+                return self.step_waiting()
+            if self.deadline is not None and time.monotonic() > self.deadline:
+                self.finish('Timeout!')
+                return True
+
+            cmd = self.command.get('cmd')
+            if cmd == 'sleep':
+                if time.monotonic()-self.started < float(self.command.get('seconds', 0)):
+                    return False
+                self.finish()
+                return True
+
+            sides = self.command['sides']
+            if not all(self.sides[side].initialized() and self.sides[side].target is not None
+                       for side in sides):
+                return False  # waiting for device initialized & target known
+
+            if cmd in ['set', 'reset']:
+                self.update(sides, self.command.get('content', {}) if cmd == 'set' else {})
+            elif cmd == 'flap':
+                for side in sides:
+                    send_spaced(self.sport, UART_MSG_MS_FLAP, [side, int(self.command['unit'])])
+                    # Flap moves the target one flap ahead, following commands (wait, set) need
+                    # the new one
+                    self.sides[side].target = None
+                    send_spaced(self.sport, UART_MSG_MS_GET_TARGET, [])
+                self.finish()
+            elif cmd == 'state':
+                self.result['state'] = {side_str(side): self.sides[side].explain()
+                                        for side in sides}
+                self.finish()
+            elif cmd == 'wait':
+                self.wait({side: list(self.sides[side].target or []) for side in sides})
+            else:
+                self.finish(f'Unknown command: {cmd}')
+        except self.COMMAND_ERRORS as e:
+            self.finish(str(e))
+        return self.command is None
+
+    def update(self, sides: List[int], content: Dict) -> None:
+        assert self.command is not None
+        sent = {}
+        for side in sides:
+            state = self.sides[side]
+            target = None if self.command.get('full', False) else state.target
+            positions = encoder.encode(content, state.positions, state.target)
+            messages = plan_update(side, target, positions)
+            for msgtype, data in messages:
+                send_spaced(self.sport, msgtype, data)
+            state.target = positions  # confirmed by firmware with target message
+            sent[side] = positions
+            self.result.setdefault('messages', {})[side_str(side)] = len(messages)
+        if self.command.get('wait', False):
+            self.wait(sent)
+        else:
+            self.finish()
+
+    def wait(self, positions: Dict[int, List[int]]) -> None:
+        self.waiting = positions
+        if self.deadline is None:
+            current = {side: self.sides[side].positions for side in positions}
+            self.deadline = time.monotonic() + \
+                estimate.estimate(current, positions, self.counts).timeout()
+
+    def step_waiting(self) -> bool:
+        assert self.waiting is not None
+        stuck = {side_str(side): [unit for unit, (cur, tgt) in
+                                  enumerate(zip(self.sides[side].positions, positions))
+                                  if cur != tgt]
+                 for side, positions in self.waiting.items()}
+        if not any(stuck.values()):
+            self.finish()
+            return True
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.result['stuck'] = stuck
+            self.finish('Timeout!')
+            return True
+        return False
+
+
+class Play:
+    """Shows vectors of compiled timetable due at current minute of day."""
+
+    def __init__(self, sport):
+        self.sport = sport
+        self.timetable = timetable.Timetable(args['<timetable.bin>'])
+        self.track = int(args['<track>'])
+        assert self.timetable.due(self.track, 0) is not None, f'No departures of {self.track}'
+        self.sides = {side: SideState() for side in args['<sides>']}
+        self.minute: Optional[int] = None
+        self.shown: Optional[int] = None  # index of record
+        send(self.sport, UART_MSG_MS_GET_TARGET, [])
+        logging.info('Waiting for device initialized...')
+
+    def received_positions(self, positions: PositionFrame, side: int, target_reached: bool,
+                           fault: bool) -> None:
+        self.sides[side].positions = positions
+
+    def received_target(self, target: PositionFrame, side: int) -> None:
+        self.sides[side].target = target
+
+    def iter(self) -> None:
+        now = time.localtime()
+        minute = now.tm_hour*60 + now.tm_min
+        if minute == self.minute:
+            return
+        if not all(state.initialized() and state.target is not None
+                   for state in self.sides.values()):
+            return
+        self.minute = minute
+
+        index = self.timetable.due(self.track, minute)
+        if index == self.shown:
+            return
+        self.shown = index
+        vector = list(self.timetable.vector(index))
+        due = self.timetable.key(index)[1]
+        logging.info(f'Showing record {index} due from {due//60}:{due%60:02}: '
+                     f'{explain_positions(vector)["final"].strip()!r}')
+        for side, state in self.sides.items():
+            positions = encoder.nearest(vector, state.positions, state.target)
+            for msgtype, data in plan_update(side, state.target, positions):
+                send_spaced(self.sport, msgtype, data)
+            state.target = positions
+
+
+class Clock:
+    """Shows current time, optionally minutes left to --countdown on delay unit.
+
+    Only these units are set (SET_SINGLE), the rest of the board is left alone. Moves towards
+    next minute start ahead of it by estimated travel time, so digits land on the boundary.
+    """
+
+    MAX_LEAD = 20  # seconds, no estimate needed earlier
+
+    def __init__(self, sport):
+        self.sport = sport
+        self.sides = {side: SideState() for side in args['<sides>']}
+        self.counts = estimate.FlapCounts(args['--counts'])
+        self.countdown = timetable.parse_minute(args['--countdown']) \
+            if args['--countdown'] else None
+        self.lead = float(args['--lead'])
+        self.shown: Optional[float] = None  # start of minute (unix time) sent to the board
+        send(self.sport, UART_MSG_MS_GET_TARGET, [])
+        logging.info('Waiting for device initialized...')
+
+    def received_positions(self, positions: PositionFrame, side: int, target_reached: bool,
+                           fault: bool) -> None:
+        self.counts.observe(side, positions)
+        self.sides[side].positions = positions
+
+    def received_target(self, target: PositionFrame, side: int) -> None:
+        self.sides[side].target = target
+
+    def units(self, moment: float) -> Dict[int, int]:  # unit -> position
+        local = time.localtime(moment)
+        minute = local.tm_hour*60 + local.tm_min
+        result = {
+            UNIT_HOURS: local.tm_hour+1,
+            UNIT_MINUTES_TENTHS: local.tm_min//10 + 1,
+            UNIT_MINUTES_ONES: local.tm_min % 10 + 1,
+        }
+        if self.countdown is not None:
+            left = (self.countdown-minute) % timetable.MINUTES_PER_DAY
+            result[UNIT_DELAY] = flap_delay(str(left))
+        return result
+
+    def targets(self, units: Dict[int, int]) -> Dict[int, List[int]]:
+        return {side: [units.get(unit, pos) for unit, pos in enumerate(state.target or [])]
+                for side, state in self.sides.items()}
+
+    def iter(self) -> None:
+        if not all(state.initialized() and state.target is not None
+                   for state in self.sides.values()):
+            return
+        now = time.time()
+        minute_start = now - now % 60
+        if self.shown is None or now - self.shown >= 120:
+            self.move(self.units(now))  # start or catch up after a stall
+            self.shown = minute_start
+            return
+
+        boundary = self.shown + 60
+        if boundary - now > self.MAX_LEAD:
+            return
+        units = self.units(boundary)
+        current = {side: list(state.positions) for side, state in self.sides.items()}
+        predicted = estimate.estimate(current, self.targets(units), self.counts)
+        # Units land somewhere within the clap period after the estimate, aim at its middle
+        lead = max(predicted.units[side][unit] for side in predicted.units for unit in units)
+        lead = max(lead - estimate.FLAP_CLAP_PERIOD.total_seconds()/2, 0) + self.lead
+        if now >= boundary - lead:
+            logging.debug(f'Moving {lead:.2f} s ahead of the minute')
+            self.move(units)
+            self.shown = boundary
+
+    def move(self, units: Dict[int, int]) -> None:
+        targets = self.targets(units)
+        for side, state in self.sides.items():
+            for unit in units:
+                if state.target is None or state.target[unit] != targets[side][unit]:
+                    send_spaced(self.sport, UART_MSG_MS_SET_SINGLE,
+                                [side, unit, targets[side][unit]])
+            state.target = targets[side]
+
+
+class Linkbench:
+    """Measures health & throughput of the serial link.
+
+    Idle firmware sends SENS & POS of both sides unsolicited once per clap period (a burst).
+    GET_POS, GET_TARGET & GET_SENS are sent in turns, one request in flight, only in quiet time
+    between bursts of an idle board, and latency is measured to the first frame of the response
+    type. A request not answered before the next burst is expected is discarded (lost, or its
+    response could not be told apart from the burst). Frame rates count frames received
+    outside request windows only, i.e. unsolicited ones.
+    """
+
+    RESPONSE_WINDOW = 0.03  # seconds, minimal quiet time left to send a request
+    BURST_GUARD = 0.005  # seconds, quiet time ends this early before burst is expected
+    REQUESTS = [
+        ('pos', UART_MSG_MS_GET_POS),
+        ('target', UART_MSG_MS_GET_TARGET),
+        ('sens', UART_MSG_MS_GET_SENS),
+    ]
+    BURST = {('sens', 0), ('sens', 1), ('pos', 0), ('pos', 1)}  # (frame, side)
+
+    def __init__(self, sport):
+        self.sport = sport
+        self.decoder = FrameDecoder()  # used by receive_loop, its counters are reported
+        self.remaining = int(args['--requests']) * len(self.REQUESTS)
+        self.latencies: Dict[str, List[float]] = {name: [] for name, _ in self.REQUESTS}
+        self.discarded: Dict[str, int] = {name: 0 for name, _ in self.REQUESTS}
+        self.frames: Dict[int, Dict[str, int]] = {
+            side: {name: 0 for name, _ in self.REQUESTS} for side in [0, 1]
+        }
+        # Request in flight: name, sent at, end of quiet time, sides yet to respond
+        self.pending: Optional[Tuple[str, float, float, Set[int]]] = None
+        self.reached = {0: True, 1: True}  # from POS frames, board is idle when both reached
+        self.period = estimate.FLAP_CLAP_PERIOD.total_seconds()  # lowered to the measured one
+        self.burst: Set[Tuple[str, int]] = set()  # frames of current burst
+        self.burst_start: Optional[float] = None
+        self.last_unsolicited = 0.0
+        self.quiet_end: Optional[float] = None  # set when burst is complete
+        self.next_request = 0
+        self.started = time.monotonic()
+        logging.info(f'Sending {self.remaining} requests...')
+
+    def received(self, name: str, side: int) -> None:
+        now = time.monotonic()
+        self.expire(now)
+        if self.pending is None:
+            self.frames[side][name] += 1
+            self.unsolicited(name, side, now)
+            return
+        pending_name, sent, _, sides = self.pending
+        if pending_name != name:
+            return
+        if len(sides) == 2:
+            self.latencies[name].append(now - sent)
+        sides.discard(side)
+        if not sides:
+            self.pending = None
+
+    def unsolicited(self, name: str, side: int, now: float) -> None:
+        if now - self.last_unsolicited > self.period/2:
+            self.burst.clear()  # previous burst incomplete (lost frame)
+        self.last_unsolicited = now
+        if not self.burst:
+            if self.burst_start is not None and all(self.reached.values()):
+                self.period = min(self.period, now - self.burst_start)
+            self.burst_start = now
+            self.quiet_end = None
+        self.burst.add((name, side))
+        if self.burst >= self.BURST:
+            self.burst.clear()
+            self.quiet_end = self.burst_start + self.period - self.BURST_GUARD
+
+    def expire(self, now: float) -> None:
+        if self.pending is None or now < self.pending[2]:
+            return
+        name, _, _, sides = self.pending
+        if len(sides) == 2:
+            self.discarded[name] += 1
+        self.pending = None
+
+    def received_positions(self, positions: PositionFrame, side: int, target_reached: bool,
+                           fault: bool) -> None:
+        self.reached[side] = target_reached
+        self.received('pos', side)
+
+    def received_target(self, target: PositionFrame, side: int) -> None:
+        self.received('target', side)
+
+    def received_sensors(self, sensors: List[int], side: int) -> None:
+        self.received('sens', side)
+
+    def iter(self) -> None:
+        now = time.monotonic()
+        self.expire(now)
+        if self.pending is not None:
+            return
+        if self.remaining == 0:
+            write_output(self.report())
+            sys.exit(0)
+        quiet_end = self.quiet_end
+        if quiet_end is None or now + self.RESPONSE_WINDOW > quiet_end or \
+                not all(self.reached.values()):
+            return  # not between bursts of idle board
+
+        name, msgtype = self.REQUESTS[self.next_request % len(self.REQUESTS)]
+        self.next_request += 1
+        self.remaining -= 1
+        send_spaced(self.sport, msgtype, [])
+        self.pending = (name, time.monotonic(), quiet_end, {0, 1})
+
+    @staticmethod
+    def percentiles(values: List[float]) -> Dict[str, float]:
+        if not values:
+            return {}
+        values = sorted(values)
+        result = {f'p{q}': values[min(len(values)*q//100, len(values)-1)] for q in [50, 90, 99]}
+        result['max'] = values[-1]
+        result['mean'] = sum(values)/len(values)
+        return {key: round(1000*value, 3) for key, value in result.items()}
+
+    def report(self) -> Dict[str, Any]:
+        duration = time.monotonic() - self.started
+        return {
+            'device': args['<device>'],
+            'duration_s': round(duration, 3),
+            'latency_ms': {
+                name: dict(self.percentiles(self.latencies[name]),
+                           answered=len(self.latencies[name]), discarded=self.discarded[name])
+                for name, _ in self.REQUESTS
+            },
+            'frames_per_second': {  # unsolicited, outside request windows
+                side_str(side): {name: round(count/duration, 2) for name, count in frames.items()}
+                for side, frames in self.frames.items()
+            },
+            'link': {
+                'bytes_received': self.decoder.received,
+                'bytes_per_second': round(self.decoder.received/duration, 1),
+                'discarded_bytes': self.decoder.discarded,
+                'xor_errors': self.decoder.xor_errors,
+                'timeout_resets': self.decoder.timeouts,
+            },
+        }
+
+
 ###############################################################################
 # Main
 
 if __name__ == '__main__':
-    global args
     args = docopt.docopt(__doc__, version=APP_VERSION)
-    args['<side>'] = side_int(args['<side>']) if args['<side>'] is not None else None
+    args['<sides>'] = sides_int(args['<side>']) if args['<side>'] is not None else None
 
     loglevel = {
         'debug': logging.DEBUG,
@@ -437,14 +894,37 @@ if __name__ == '__main__':
         'critical': logging.CRITICAL,
     }.get(args['-l'], logging.INFO)
     logging.basicConfig(
-        stream=sys.stdout,
+        stream=sys.stderr if args['stream'] or args['loop'] or args['linkbench'] or args['--stages']
+        else sys.stdout,
         level=loglevel,
         format='[%(asctime)s.%(msecs)03d] %(levelname)s %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S',
     )
 
-    sport = serial.Serial(args['<device>'], 115200)
+    if args['compile-timetable']:
+        sys.exit(timetable.compile_file(args['<timetable>'], args['<output.bin>']))
+
+    state_path = statefile.default_path(args['<device>']) if args['--state-file'] == 'auto' \
+        else args['--state-file']
+    if args['state'] and args['--cached']:
+        assert len(args['<sides>']) == 1, 'State can be read from single side only'
+        if state_path != 'none':
+            cached = read_cached_state(state_path, args['<sides>'][0], float(args['--max-age']))
+            if cached is not None:
+                write_output(cached)
+                sys.exit(0)
+        logging.info('Cached state not available, querying board...')
+
+    sport = serial.Serial(args['<device>'], 115200, exclusive=True)
     logging.debug(f'Connected to {args["<device>"]}')
+    if args['--capture']:
+        import capture  # not at the top, capture.py replay imports this module
+        sport = capture.CapturingPort(sport, capture.Capture(args['--capture']))
+    if state_path != 'none':
+        try:
+            state_file = statefile.StateFile(state_path, writable=True)
+        except OSError as e:
+            logging.warning(f'Unable to open state cache {state_path}: {e}')
 
     PROGRAMS = {
         'set_positions': SetPositions,
@@ -452,6 +932,11 @@ if __name__ == '__main__':
         'flap': Flap,
         'loop': Loop,
         'state': State,
+        'estimate': Estimate,
+        'stream': Stream,
+        'play': Play,
+        'clock': Clock,
+        'linkbench': Linkbench,
     }
 
     program = None
@@ -461,29 +946,6 @@ if __name__ == '__main__':
             break
     assert program is not None, 'Unknown program'
 
-    receive_buf = []
-    last_receive_time = datetime.datetime.now()
-    while True:
-        received = sport.read(1)
-        if not received:
-            sys.stderr.write('Port interrupt!\n')
-            sys.exit(1)
-        if receive_buf and datetime.datetime.now()-last_receive_time > RECEIVE_TIMEOUT:
-            logging.debug('Clearing data, timeout!')
-            receive_buf.clear()
-        last_receive_time = datetime.datetime.now()
-        receive_buf += received
-        while len(receive_buf) > 0 and receive_buf[0] != UART_RECEIVE_MAGIC:
-            logging.debug(f'Popping packet: {receive_buf[0]}')
-            receive_buf.pop(0)
-
-        while len(receive_buf) >= 2 and len(receive_buf) >= receive_buf[1]+4:
-            packet_length = receive_buf[1]+4
-            parse(receive_buf[0:packet_length], program)
-            receive_buf = receive_buf[packet_length:]
-            while len(receive_buf) > 0 and receive_buf[0] != UART_RECEIVE_MAGIC:
-                logging.debug(f'Popping packet: {receive_buf[0]}')
-                receive_buf.pop(0)
-
-        if getattr(program, 'iter', None):
-            program.iter()
+    receive_loop(sport, program)
+    sys.stderr.write('Port interrupt!\n')
+    sys.exit(1)
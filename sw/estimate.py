@@ -0,0 +1,122 @@
+# edulint: flake8=--max-line-length=100
+
+"""
+Movement time estimation of Solari di Udine platform board
+
+Firmware claps all units of one side that are not in place once per
+FLAP_CLAP_PERIOD. When both sides have something to do, side A is moved first
+and side B after it (switching side costs one period). Units turn in one
+direction only, so distance to the target is cyclic modulo number of flaps of
+the unit. Number of flaps of each unit is learned from position wrapping to 0
+(as flap_counts in the firmware), defaults come from label tables.
+"""
+
+import datetime
+import json
+import os
+from typing import List, Dict, Optional, NamedTuple, Mapping, Sequence
+
+import protocol
+
+FLAP_CLAP_PERIOD = datetime.timedelta(milliseconds=150)  # FLAP_CLAP_PERIOD_MS in fw/src/flap.h
+
+# Timeout of waiting for target derived from estimate
+TIMEOUT_FACTOR = 1.5
+TIMEOUT_MARGIN = datetime.timedelta(seconds=5)
+
+
+def default_flap_counts() -> List[int]:
+    alphabet = len(protocol.FLAP_ALPHABET)
+    counts = [alphabet]*protocol.FLAP_UNITS  # final station units
+    counts[0] = len(protocol.FLAP_TYPES)+1
+    counts[1:6] = [21]*protocol.FLAP_TRAINNUM_COUNT  # blank, 0-9, red 0-9
+    counts[12] = len(protocol.FLAP_DIRECTIONS_1)+1
+    counts[13] = len(protocol.FLAP_DIRECTIONS_2)+1
+    counts[14] = 25  # blank, 0-23
+    counts[15] = 7  # blank, 0-5
+    counts[24] = 11  # blank, 0-9
+    counts[25] = len(protocol.FLAP_DELAYS_MIN)+len(protocol.FLAP_DELAYS_NEXT)+1
+    return counts
+
+
+class FlapCounts:
+    """Number of flaps of each unit of both sides, learned from position stream."""
+
+    def __init__(self, filename: Optional[str] = None):
+        self.filename = filename
+        self.learned: List[List[Optional[int]]] = [[None]*protocol.FLAP_UNITS for _ in range(2)]
+        self.last: List[Optional[Sequence[int]]] = [None, None]
+        self.defaults = default_flap_counts()
+        if filename is not None and os.path.exists(filename):
+            with open(filename) as f:
+                for side, counts in json.load(f).items():
+                    self.learned[protocol.side_int(side)] = counts
+
+    def save(self) -> None:
+        if self.filename is None:
+            return
+        with open(self.filename, 'w') as f:
+            json.dump({protocol.side_str(side): counts for side, counts in enumerate(self.learned)},
+                      f, indent='    ')
+
+    def observe(self, side: int, positions: Sequence[int]) -> None:
+        last = self.last[side]
+        if last is not None:
+            for unit, (old, new) in enumerate(zip(last, positions)):
+                if new == 0 and 0 < old < 0xFF:
+                    # Firmware increments position and resets it to 0 in the same step
+                    learned = self.learned[side][unit]
+                    self.learned[side][unit] = max(old+1, learned if learned is not None else 0)
+        self.last[side] = positions
+
+    def count(self, side: int, unit: int) -> int:
+        learned = self.learned[side][unit]
+        return learned if learned is not None else self.defaults[unit]
+
+    def side(self, side: int) -> List[int]:
+        return [self.count(side, unit) for unit in range(protocol.FLAP_UNITS)]
+
+
+def unit_flaps(current: int, target: int, count: int) -> int:
+    if target >= count:
+        target = 0  # firmware does the same
+    if current == 0xFF:
+        return count + target  # unknown position, worst case: whole turn to reset sensor
+    return (target - current) % count
+
+
+def side_flaps(current: Sequence[int], target: Sequence[int], counts: List[int]) -> List[int]:
+    return [unit_flaps(cur, tgt, cnt) for cur, tgt, cnt in zip(current, target, counts)]
+
+
+class Estimate(NamedTuple):
+    units: Dict[int, List[float]]  # side -> seconds until each unit is in place
+    sides: Dict[int, float]  # side -> seconds until whole side is in place
+    total: float
+
+    def timeout(self) -> float:
+        return self.total*TIMEOUT_FACTOR + TIMEOUT_MARGIN.total_seconds()
+
+    def json(self) -> Dict:
+        result: Dict = {
+            protocol.side_str(side): {'seconds': self.sides[side], 'units': self.units[side]}
+            for side in self.units
+        }
+        result['total'] = self.total
+        return result
+
+
+def estimate(current: Mapping[int, Sequence[int]], target: Mapping[int, Sequence[int]],
+             counts: FlapCounts) -> Estimate:
+    period = FLAP_CLAP_PERIOD.total_seconds()
+    units: Dict[int, List[float]] = {}
+    sides: Dict[int, float] = {}
+    offset = 0.0
+    for side in sorted(target.keys()):
+        flaps = side_flaps(current[side], target[side], counts.side(side))
+        if max(flaps) > 0:
+            offset += period  # side switch
+        units[side] = [offset + count*period if count > 0 else 0.0 for count in flaps]
+        sides[side] = max(units[side])
+        offset = max(offset, sides[side])
+    return Estimate(units, sides, offset)
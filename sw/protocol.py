@@ -0,0 +1,631 @@
+# edulint: flake8=--max-line-length=100
+
+"""
+UART protocol & flap encoding of Solari di Udine platform board
+
+Frame constants & framing, encoding of content to flap positions and decoding
+of positions back to labels. Shared by control.py and the modules it uses,
+imports none of them.
+"""
+
+import time
+import bisect
+import datetime
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator, Sequence, Union, overload
+
+UART_RECEIVE_MAGIC = 0xB7
+UART_SEND_MAGIC = 0xCA
+
+UART_MSG_MS_GET_SENS = 0x01
+UART_MSG_MS_GET_POS = 0x02
+UART_MSG_MS_GET_TARGET = 0x03
+UART_MSG_MS_FLAP = 0x10
+UART_MSG_MS_SET_SINGLE = 0x11
+UART_MSG_MS_SET_ALL = 0x12
+
+UART_MSG_SM_SENS = 0x01
+UART_MSG_SM_POS = 0x02
+UART_MSG_SM_TARGET = 0x03
+
+RECEIVE_TIMEOUT = datetime.timedelta(milliseconds=200)
+# Firmware ignores frames arriving before the previous one is processed
+SEND_GAP = datetime.timedelta(milliseconds=2)
+BAUDRATE = 115200
+UART_BITS_PER_BYTE = 10  # start bit, 8 data bits, stop bit
+FRAME_OVERHEAD = 4  # magic, length, message type, checksum
+
+FLAP_UNITS = 26
+FLAP_ALPHABET = ' 0123456789aáäbcčdďeéěfghiíjklmnňoóöpqrřsštťuúůüvwxyýzž/.-()'
+FLAP_FINAL_LEN = 14
+FLAP_TRAINNUM_COUNT = 5
+
+FLAP_TYPES = [
+    'Ec', 'Ic', 'Ex R', 'Ex lůžkový', 'Ex', 'R R', 'R lůžkový', 'R', 'Sp', 'Os',
+    'Mim. Ex', 'Mim. R', 'Mim. Sp', 'Mim. Os', 'Zvláštní vlak', 'Special train',
+    'Parní vlak', 'Steam train', 'IR', 'ICE', 'Sc', 'TGV', '', 'Ic bílá', 'Sp',
+]
+
+FLAP_DIRECTIONS_1 = [
+    'Adamov', 'Adamov-Blansko', 'Bylnice', 'Blansko', 'Blažovice', 'Bohumín',
+    'Břeclav', 'Břeclav-Kúty', 'Břeclav-Bratislava', 'Bučovice', 'Bzenec',
+    'Česká Třebová', 'Č.Třebová-Pardubice', 'Havlíčkův Brod', 'Holubice',
+    'Horní Cerekev', 'Hradec Králové', 'Jihlava', 'Jihlava-Horní Cerekev',
+    'Kolín', 'Kojetín', 'Kroměříž', 'Křižanov', 'Kunovice', 'Kuřim', 'Kuřim-Tišnov',
+    'Kyjov', 'Modřice', 'Moravské Bránice', 'Moravský Krumlov', 'Náměšť nad Oslavou',
+    'Nezamyslice', 'Olomouc hl.n.', 'Olomouc-Uničov', 'Ostrava hl.n.',
+    'Ostrava-Vítkovice', 'Pardubice hl.n.', 'Praha-Holešovice', 'Přerov',
+    'Přerov-Bohumín', 'Prostějov hl.n.', 'Prostějov-Olomouc', 'Rajhrad',
+    'Rousínov', 'Šakvice', 'Skalice nad Svitavou', 'Sokolnice-Teln.', 'Střelice',
+    'Studenec', 'Studénka', 'Tišnov', 'Veselí nad Moravou', 'Vranovice',
+    'Vyškov na Moravě', 'Zastávka u Brna', 'Žďár nad Sázavou', '?', 'Studenec',
+    'Štúrovo', 'Svitavy', 'Tábor', 'Tišnov', 'Tišnov-Křižanov', 'Trenč. Teplá',
+    'Turnov', 'Uherské Hradiště', '?'
+]
+
+FLAP_DIRECTIONS_2 = [
+    'Blansko', 'Bohumín', 'Bojkovice', 'Břeclav', 'Bratislava', 'Bylnice',
+    'Bučovice', 'Bzenec', 'Čadca', 'České Budějovice', 'Český Těšín', 'Chornice',
+    'Děčin', 'Frýdek-Místek', 'Havířov', 'Havlíčkův Brod', 'Holubice', 'Horní Cerekev',
+    'Hradec Králové', 'Hranice na Moravě', 'Hrušovany nad Jevišovkou', 'Hulín',
+    'Kolína', 'Komárno', 'Kyjov', 'Kyjov Bzenec', 'Křižanov', 'Kunovice', 'Kúty',
+    'Moravské Bránice', 'Moravský Krumlov', 'Moravský Písek', 'Moravská Třebová',
+    'Mosty u Jablunkova', 'Náměšť nad Oslavou', 'Nezamyslice', 'Nové Město na Moravě',
+    'Okříšky', 'Ostrava hl.n.', 'Ostrava-Svinov', 'Ostrava-Vítkovice', 'Pardubice hl.n.',
+    'Pardubice-Kolín', 'Praha-Holešovice', 'Přerov', 'S1', 'S2', 'S3', 'S4', 'S41',
+    'S5', 'S6', 'S7', 'R1', 'R2', 'R3', 'R4', 'R41', 'R5', 'R6', 'R7', 'Uničov',
+    'Ústí nad Labem', 'Valašské Meziřící', 'Veselí nad Lužnicí', 'Veseá nad Moravou',
+    'Vyškov na Moravě', 'Zábřeh na Moravě', 'Zaječí', 'Žďár nad Sázavou', 'Žilina',
+    'Kojetín', 'Vlárský Průsmyk', 'Tábor-Veselí nad Lužnicí', '', 'Praha hl.n.',
+    '', 'ODKLON']
+
+FLAP_DELAYS_MIN = [
+    5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 70, 80, 90, 100, 110,
+    120, 130, 140, 150, 160, 170, 180, 200, 220, 240, 260, 280, 300, 330, 360,
+    390, 420, 450, 480
+]
+
+FLAP_DELAYS_NEXT = [
+    '>480', 'VLAK NEJEDE', 'BUS'
+]
+
+UNIT_HOURS = 14
+UNIT_MINUTES_TENTHS = 15
+UNIT_MINUTES_ONES = 24
+UNIT_DELAY = 25
+
+# SET_SINGLE frame has 7 bytes, SET_ALL 31 bytes -> SET_ALL is cheaper for more changed units
+UPDATE_SINGLE_MAX_UNITS = 4
+
+
+def xor(data: Iterable[int]) -> int:
+    result = 0
+    for num in data:
+        result ^= num
+    return result
+
+
+def send(sport, msgtype: int, data: List[int]) -> None:
+    _data = data[:]
+    _data.insert(0, msgtype)
+    _data.insert(0, len(data))
+    _data.insert(0, UART_SEND_MAGIC)
+    _data.append(xor(_data))
+
+    logging.debug(f'< Send: {_data}')
+    sport.write(_data)
+
+
+class SendPacer:
+    """Keeps SEND_GAP between the end of a frame on the wire and the start of the next one.
+
+    write() returns as soon as the frame is buffered, so the gap is counted from the time
+    the frame takes on the wire (2.7 ms for SET_ALL at 115200 Bd), not from write().
+    """
+
+    def __init__(self, baudrate: int = BAUDRATE):
+        self.byte_time = UART_BITS_PER_BYTE / baudrate
+        self.next_send = 0.0
+
+    def reserve(self, now: float, data_len: int) -> float:
+        # Returns time to write frame with data_len bytes of data at, `now` in the same clock
+        send_at = max(now, self.next_send)
+        self.next_send = send_at + (data_len + FRAME_OVERHEAD)*self.byte_time + \
+            SEND_GAP.total_seconds()
+        return send_at
+
+
+_pacer = SendPacer()
+
+
+def send_spaced(sport, msgtype: int, data: List[int], pacer: Optional[SendPacer] = None) -> None:
+    # Same as send(), paced by `pacer` (shared one of the process by default)
+    now = time.monotonic()
+    delay = (pacer or _pacer).reserve(now, len(data)) - now
+    if delay > 0:
+        time.sleep(delay)
+    send(sport, msgtype, data)
+
+
+def flap_str(lst: Sequence[str], i: int) -> str:
+    if i == 0xFF:
+        return '?'
+    return lst[i-1] if i > 0 and i <= len(lst) else ''
+
+
+def side_str(_side: int) -> str:
+    if (_side & 1) == 0:
+        return 'A'
+    if (_side & 1) == 1:
+        return 'B'
+    return '?'
+
+
+def side_int(_side: str) -> int:
+    _side = _side.lower()
+    if _side == 'a':
+        return 0
+    if _side == 'b':
+        return 1
+
+    assert False, 'Invalid side'
+
+
+def sides_int(_side: str) -> List[int]:
+    if _side.lower() in ['ab', 'both']:
+        return [0, 1]
+    return [side_int(_side)]
+
+
+class FrameDecoder:
+    """Splits received bytes into frames without copying them.
+
+    Frames returned by feed() are memoryviews into the receive buffer, which are valid only until
+    the next feed(); callers that need to keep a frame must copy it.
+    """
+
+    def __init__(self, timeout: datetime.timedelta = RECEIVE_TIMEOUT):
+        self.buf = bytearray()
+        self.timeout = timeout.total_seconds()
+        self.last_receive_time = time.monotonic()
+        self.received = 0  # bytes fed
+        self.discarded = 0  # bytes thrown away while looking for magic
+        self.xor_errors = 0
+        self.timeouts = 0
+        self.consumed = 0  # bytes at the start of buf split into frames by previous feed()
+        self.frames: List[memoryview] = []  # returned by previous feed()
+
+    def feed(self, data: Union[bytes, memoryview], now: Optional[float] = None) -> List[memoryview]:
+        # Buffers `data` at once and returns frames completed by it.
+        # `now` (seconds) is given when replaying recorded data
+        for frame in self.frames:
+            frame.release()
+        self.frames = []
+        del self.buf[:self.consumed]
+        self.consumed = 0
+
+        now = time.monotonic() if now is None else now
+        if self.buf and now-self.last_receive_time > self.timeout:
+            logging.debug('Clearing data, timeout!')
+            self.timeouts += 1
+            self.discarded += len(self.buf)
+            self.buf.clear()
+        self.last_receive_time = now
+        self.received += len(data)
+        self.buf += data
+
+        buf = self.buf
+        start = 0
+        with memoryview(buf) as view:
+            while start < len(buf):
+                magic = buf.find(UART_RECEIVE_MAGIC, start)
+                if magic < 0:
+                    magic = len(buf)
+                if magic > start:
+                    logging.debug(f'Popping {magic-start} bytes')
+                    self.discarded += magic-start
+                    start = magic
+                if len(buf)-start < 2:
+                    break
+                end = start + buf[start+1] + 4
+                if end > len(buf):
+                    break
+
+                frame = view[start:end]
+                start = end
+                if xor(frame) != 0:
+                    logging.warning(f'Invalid xor: {list(frame)}')
+                    self.xor_errors += 1
+                    frame.release()
+                    continue
+                self.frames.append(frame)
+        self.consumed = start
+        return self.frames
+
+
+def flap_number(num: int, length: int) -> List[int]:  # always returns list of length `length`
+    if num == 0:
+        return [0]*length
+    numstr = str(num).rjust(length, '~')[-length:]
+    return [int(char)+1 if char != '~' else 0 for char in numstr]
+
+
+def _label_equivalents(labels: List[str]) -> Dict[int, Tuple[int, ...]]:
+    # Positions showing the same label; blank label looks the same as position 0
+    groups: Dict[str, List[int]] = {}
+    for i, label in enumerate(labels):
+        groups.setdefault(label, [0] if label == '' else []).append(i+1)
+    return {pos: tuple(group) for group in groups.values() if len(group) > 1 for pos in group}
+
+
+def _first_index(lst: Iterable) -> Dict[Any, int]:  # same as lst.index(item) for each item
+    result: Dict[Any, int] = {}
+    for i, item in enumerate(lst):
+        result.setdefault(item, i)
+    return result
+
+
+class Encoder:
+    """Encodes content (see content.json) to flap positions.
+
+    Label lookups are indexed once, whole content dicts are cached (LRU). When current positions
+    are given, labels present on more flaps of a unit are encoded as the flap nearest ahead
+    (units turn in one direction only).
+    """
+
+    def __init__(self, cache_size: int = 1024):
+        self.alphabet = _first_index(FLAP_ALPHABET)
+        self.types = _first_index(FLAP_TYPES)
+        self.directions_1 = _first_index(FLAP_DIRECTIONS_1)
+        self.directions_2 = _first_index(FLAP_DIRECTIONS_2)
+        self.delays_next = _first_index(FLAP_DELAYS_NEXT)
+        self.cache_size = cache_size
+        self.cache: OrderedDict[Any, Tuple[int, ...]] = OrderedDict()
+        self.equivalents = {
+            0: _label_equivalents(FLAP_TYPES),
+            12: _label_equivalents(FLAP_DIRECTIONS_1),
+            13: _label_equivalents(FLAP_DIRECTIONS_2),
+        }
+
+    @staticmethod
+    def label(index: Dict[Any, int], label: Any) -> int:
+        try:
+            return index[label]
+        except (KeyError, TypeError):
+            raise ValueError(f'{label!r} is not available!') from None
+
+    def final(self, final: str) -> List[int]:  # always returns list of length FLAP_FINAL_LEN
+        for letter in final.lower():
+            assert letter in self.alphabet, f'Letter "{letter}" is not available!'
+        return [self.alphabet[char] for char in final.lower().ljust(FLAP_FINAL_LEN, ' ')]
+
+    def delay(self, delay: str) -> int:
+        if delay.upper() in self.delays_next:
+            return self.delays_next[delay.upper()] + len(FLAP_DELAYS_MIN) + 1
+
+        if ':' in delay:
+            hours, minutes = map(int, delay.split(':'))
+            minutes += hours*60
+        elif delay.isdecimal():
+            minutes = int(delay)
+        else:
+            assert False, 'Invalid delay'
+
+        if minutes > 480:
+            return len(FLAP_DELAYS_MIN) + 1
+
+        # Pick nearest lower delay (0 if there is none)
+        return bisect.bisect_right(FLAP_DELAYS_MIN, minutes)
+
+    def encode(self, content: Dict, current: Optional[Sequence[int]] = None,
+               target: Optional[Sequence[int]] = None) -> List[int]:
+        # always returns list of length FLAP_UNITS
+        result = self._encode_cached(content)
+        if current is not None:
+            result = self.nearest(result, current, target)
+        return result
+
+    def nearest(self, positions: Sequence[int], current: Sequence[int],
+                target: Optional[Sequence[int]] = None) -> List[int]:
+        # Replaces positions with equivalent ones reached in the fewest flaps from `current`,
+        # keeps equivalent `target` to avoid restarting units
+        result = list(positions)
+        for unit, equivalents in self.equivalents.items():
+            candidates = equivalents.get(result[unit])
+            if candidates is None:
+                continue
+            if target is not None and target[unit] in candidates:
+                result[unit] = target[unit]
+            elif current[unit] != 0xFF:
+                cur = current[unit]
+                result[unit] = min(candidates, key=lambda pos: (pos < cur, pos))
+        return result
+
+    def _encode_cached(self, content: Dict) -> List[int]:
+        try:
+            key: Any = tuple(sorted(content.items()))
+            hash(key)
+        except TypeError:
+            key = None
+
+        if key is not None and key in self.cache:
+            self.cache.move_to_end(key)
+            return list(self.cache[key])
+
+        result = self._encode(content)
+        if key is not None:
+            self.cache[key] = tuple(result)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result
+
+    def _encode(self, content: Dict) -> List[int]:
+        final_str = content.get('final', '')
+        if len(final_str) > FLAP_FINAL_LEN:
+            final_str = final_str[:FLAP_FINAL_LEN-1] + '.'
+        final = self.final(final_str)
+        assert len(final) == FLAP_FINAL_LEN, f'Invalid length: {len(final)}!'
+
+        hours, minutes = map(int, content['time'].split(':')) if 'time' in content \
+            else (0xFF, 0xFF)
+
+        result = []
+        result += [self.label(self.types, content['type'])+1] if 'type' in content else [0]
+        trainnum = flap_number(content.get('num', 0), FLAP_TRAINNUM_COUNT)
+        if content.get('num_red', False):
+            trainnum = [v+10 if v != 0 else 0 for v in trainnum]
+        result += trainnum
+        result += final[0:2]
+        result += final[10:14]
+        result += [self.label(self.directions_1, content['direction1'])+1] \
+            if 'direction1' in content else [0]
+        result += [self.label(self.directions_2, content['direction2'])+1] \
+            if 'direction2' in content else [0]
+        result += [hours+1] if hours != 0xFF else [0]
+        result += [(minutes//10)+1] if minutes != 0xFF else [0]
+        result += final[2:10]  # 0x10-0x17
+        result += [(minutes % 10) + 1] if minutes != 0xFF else [0]
+        result += [self.delay(content['delay'])] if 'delay' in content else [0]
+
+        assert len(result) == FLAP_UNITS
+        return result
+
+
+encoder = Encoder()
+
+
+def flap_final(final: str) -> List[int]:  # always returns list of length FLAP_FINAL_LEN
+    return encoder.final(final)
+
+
+def flap_delay(delay: str) -> int:
+    return encoder.delay(delay)
+
+
+def flap_all_positions(content: Dict, current: Optional[Sequence[int]] = None,
+                       target: Optional[Sequence[int]] = None) -> List[int]:
+    # always returns list of length FLAP_UNITS
+    return encoder.encode(content, current, target)
+
+
+def plan_update(side: int, target: Optional[Sequence[int]],
+                positions: Sequence[int]) -> List[Tuple[int, List[int]]]:
+    # Returns messages (msgtype, data) to move from `target` (None = unknown) to `positions`
+    if target is None:
+        return [(UART_MSG_MS_SET_ALL, [side] + list(positions))]
+    changed = [i for i, (old, new) in enumerate(zip(target, positions)) if old != new]
+    if len(changed) > UPDATE_SINGLE_MAX_UNITS:
+        return [(UART_MSG_MS_SET_ALL, [side] + list(positions))]
+    return [(UART_MSG_MS_SET_SINGLE, [side, i, positions[i]]) for i in changed]
+
+
+def _explain_num(data: Sequence[int]) -> Optional[int]:
+    num_data = data[1:6]
+    if all(num == 0 for num in num_data):
+        return None
+    trainnum = 0
+    for i, numeral in enumerate(num_data):
+        if numeral == 0:
+            numeral = 1
+        trainnum += (10**(len(num_data)-i-1)) * ((numeral-1) % 10)
+    return trainnum
+
+
+def _explain_delay(delay: int) -> str:
+    if delay == 0xFF:
+        return '?'
+    if delay == 0:
+        return ''
+    delay_i = delay-1
+    if delay_i < len(FLAP_DELAYS_MIN):
+        minutes = FLAP_DELAYS_MIN[delay_i]
+        return f'{minutes//60}:{str(minutes%60).zfill(2)}'
+    if delay_i < len(FLAP_DELAYS_MIN) + len(FLAP_DELAYS_NEXT):
+        return FLAP_DELAYS_NEXT[delay_i-len(FLAP_DELAYS_MIN)]
+    return ''
+
+
+def _explain_time(hours: int, minutes_tenths: int, minutes_ones: int) -> str:
+    if hours > 24 or minutes_tenths > 10 or minutes_ones > 10:
+        return '?'
+    if hours == 0 or minutes_tenths == 0 or minutes_ones == 0:
+        return ''
+    minutes = (minutes_tenths-1)*10 + (minutes_ones-1)
+    return f'{hours-1}:{str(minutes).zfill(2)}'
+
+
+FINAL_UNITS = [6, 7, 16, 17, 18, 19, 20, 21, 22, 23, 8, 9, 10, 11]  # letters left to right
+
+_UNDECODED: Any = object()
+
+
+class PositionFrame(Sequence[int]):
+    """Positions of all units of a side (data of POS or TARGET frame) backed by bytes.
+
+    Equality and diff() work on raw bytes, labels are decoded on first access and cached.
+    Behaves as a read-only sequence of ints, compares equal to list of the same positions.
+    """
+
+    __slots__ = ('raw', '_type', '_num', '_direction1', '_direction2', '_time', '_delay',
+                 '_final')
+
+    def __init__(self, raw: Iterable[int]):
+        self.raw = bytes(raw)
+        self._type = self._num = self._direction1 = self._direction2 = _UNDECODED
+        self._time = self._delay = self._final = _UNDECODED
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+    @overload
+    def __getitem__(self, index: int) -> int: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[int]: ...
+
+    def __getitem__(self, index):
+        return self.raw[index] if isinstance(index, int) else list(self.raw[index])
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.raw)
+
+    def __contains__(self, pos: object) -> bool:
+        return isinstance(pos, int) and 0 <= pos <= 0xFF and pos in self.raw
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, PositionFrame):
+            return self.raw == other.raw
+        if isinstance(other, (bytes, bytearray)):
+            return self.raw == other
+        if isinstance(other, (list, tuple)):
+            return len(other) == len(self.raw) and all(a == b for a, b in zip(self.raw, other))
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.raw)
+
+    def __repr__(self) -> str:
+        return f'PositionFrame({list(self.raw)})'
+
+    def initialized(self) -> bool:
+        return 0xFF not in self.raw
+
+    def diff(self, other: Optional[Sequence[int]]) -> List[int]:  # units with other position
+        if other is None:
+            return list(range(len(self.raw)))
+        other_raw = other.raw if isinstance(other, PositionFrame) else other
+        if self.raw == other_raw:
+            return []
+        return [unit for unit, (a, b) in enumerate(zip(self.raw, other_raw)) if a != b]
+
+    @property
+    def type(self) -> str:
+        if self._type is _UNDECODED:
+            self._type = flap_str(FLAP_TYPES, self.raw[0])
+        return self._type
+
+    @property
+    def num(self) -> Optional[int]:
+        if self._num is _UNDECODED:
+            self._num = _explain_num(self.raw)
+        return self._num
+
+    @property
+    def num_red(self) -> bool:
+        return any(num > 10 for num in self.raw[1:6])
+
+    @property
+    def direction1(self) -> str:
+        if self._direction1 is _UNDECODED:
+            self._direction1 = flap_str(FLAP_DIRECTIONS_1, self.raw[12])
+        return self._direction1
+
+    @property
+    def direction2(self) -> str:
+        if self._direction2 is _UNDECODED:
+            self._direction2 = flap_str(FLAP_DIRECTIONS_2, self.raw[13])
+        return self._direction2
+
+    @property
+    def time(self) -> str:
+        if self._time is _UNDECODED:
+            self._time = _explain_time(self.raw[14], self.raw[15], self.raw[24])
+        return self._time
+
+    @property
+    def delay(self) -> str:
+        if self._delay is _UNDECODED:
+            self._delay = _explain_delay(self.raw[25])
+        return self._delay
+
+    @property
+    def final(self) -> str:
+        if self._final is _UNDECODED:
+            self._final = ''.join(flap_str(FLAP_ALPHABET, min(self.raw[unit]+1, 0xFF))
+                                  for unit in FINAL_UNITS)
+        return self._final
+
+    def explain(self, raw: bool = True) -> Dict:
+        result: Dict[str, Any] = {}
+        if raw:
+            data = self.raw
+            result['raw'] = {
+                'type': data[0],
+                'num': list(data[1:6]),
+                'direction1': data[12],
+                'direction2': data[13],
+                'delay': data[25],
+                'time': {
+                    'minutes_ones': data[24],
+                    'minutes_tenths': data[15],
+                    'hours': data[14],
+                },
+                'final': [data[unit] for unit in FINAL_UNITS],
+            }
+        result['type'] = self.type
+        if self.num is not None:
+            result['num'] = self.num
+            result['num_red'] = self.num_red
+        result['direction1'] = self.direction1
+        result['direction2'] = self.direction2
+        result['delay'] = self.delay
+        result['time'] = self.time
+        result['final'] = self.final
+        return result
+
+
+def explain_positions(data: Sequence[int]) -> Dict:
+    assert len(data) >= FLAP_UNITS
+    if len(data) > FLAP_UNITS:
+        logging.warning(f'{len(data)} bytes of positions received, however {FLAP_UNITS} expected!')
+    frame = data if isinstance(data, PositionFrame) else PositionFrame(data)
+    return frame.explain()
+
+
+class SideState:
+    """Last known state of a single side of the board."""
+
+    __slots__ = ('positions', 'target', 'sensors', 'target_reached', 'fault', 'updated')
+
+    def __init__(self):
+        self.positions: Sequence[int] = PositionFrame(bytes([0xFF])*FLAP_UNITS)
+        self.target: Optional[Sequence[int]] = None
+        self.sensors: List[int] = []
+        self.target_reached = False
+        self.fault = False
+        self.updated: Optional[datetime.datetime] = None
+
+    def initialized(self) -> bool:
+        return 0xFF not in self.positions
+
+    def explain(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {}
+        result['current'] = explain_positions(self.positions)
+        result['current']['target_reached'] = self.target_reached
+        result['current']['fault'] = self.fault
+        if self.target is not None:
+            result['target'] = explain_positions(self.target)
+        if self.updated is not None:
+            result['updated'] = self.updated.isoformat()
+        return result
@@ -0,0 +1,209 @@
+# edulint: flake8=--max-line-length=100
+
+"""
+Asyncio API for Solari di Udine platform board
+
+Serial port is read via event loop selector, so the board can share one event
+loop with other code (hJOP client, HTTP server, ...).
+
+Example:
+    async with SolariBoard('/dev/ttyAMA0') as board:
+        await board.set_positions('A', {'type': 'Os', 'num': 4321}, wait=True, timeout=60)
+        async for update in board.updates():
+            print(update)
+"""
+
+import asyncio
+import datetime
+import logging
+from typing import List, Dict, Any, Optional, Callable, AsyncIterator, NamedTuple, Sequence, \
+    Tuple, Union
+import serial
+
+import control
+import protocol
+from protocol import FLAP_UNITS, PositionFrame, SideState, UART_MSG_MS_GET_TARGET, \
+    UART_MSG_MS_FLAP
+
+Side = Union[str, int]
+
+UPDATES_QUEUE = 64  # updates buffered per updates() iterator, the oldest are dropped
+
+
+class Update(NamedTuple):
+    kind: str  # 'positions', 'target' or 'sensors'
+    side: int
+    data: Sequence[int]  # PositionFrame for positions & target
+    target_reached: bool = False
+    fault: bool = False
+
+
+def _side(side: Side) -> int:
+    return side if isinstance(side, int) else protocol.side_int(side)
+
+
+class SolariBoard:
+    def __init__(self, device: str, baudrate: int = 115200):
+        self.device = device
+        self.baudrate = baudrate
+        self.sport: Optional[serial.Serial] = None
+        self.sides = [SideState(), SideState()]
+        self._decoder = protocol.FrameDecoder()
+        self._waiters: List[Tuple[Callable[[], bool], asyncio.Future]] = []
+        self._subscribers: List[asyncio.Queue] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pacer = protocol.SendPacer(baudrate)
+
+    async def open(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self.sport = serial.Serial(self.device, self.baudrate, timeout=0,
+                                   exclusive=True)
+        self._loop.add_reader(self.sport.fileno(), self._readable)
+        logging.debug(f'Connected to {self.device}')
+
+    def close(self) -> None:
+        if self.sport is None:
+            return
+        if self._loop is not None:
+            self._loop.remove_reader(self.sport.fileno())
+        self.sport.close()
+        self.sport = None
+        self._fail_waiters(ConnectionError('Port closed'))
+
+    async def __aenter__(self) -> 'SolariBoard':
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.close()
+
+    ###########################################################################
+    # Transport
+
+    def _readable(self) -> None:
+        assert self.sport is not None
+        try:
+            received = self.sport.read(max(self.sport.in_waiting, 1))
+        except serial.SerialException as e:
+            logging.error(f'Port interrupt: {e}')
+            self.close()
+            return
+        for frame in self._decoder.feed(received):
+            control.parse(frame, self)
+
+    def send(self, msgtype: int, data: List[int]) -> None:
+        if self.sport is None or self._loop is None:
+            raise ConnectionError('Port not open')
+        now = self._loop.time()
+        send_at = self._pacer.reserve(now, len(data))
+        if send_at > now:
+            self._loop.call_at(send_at, self._write, msgtype, data)
+        else:
+            self._write(msgtype, data)
+
+    def _write(self, msgtype: int, data: List[int]) -> None:
+        if self.sport is not None:
+            protocol.send(self.sport, msgtype, data)
+
+    def _publish(self, update: Update) -> None:
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()  # slow consumer, drop the oldest update
+                logging.debug('Update queue full, oldest update dropped')
+            queue.put_nowait(update)
+        for predicate, future in self._waiters:
+            if not future.done() and predicate():
+                future.set_result(None)
+
+    def _fail_waiters(self, exc: Exception) -> None:
+        for _, future in self._waiters:
+            if not future.done():
+                future.set_exception(exc)
+
+    async def _wait_for(self, predicate: Callable[[], bool], timeout: Optional[float]) -> None:
+        if predicate():
+            return
+        assert self._loop is not None, 'Board not open'
+        waiter = (predicate, self._loop.create_future())
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        finally:
+            self._waiters.remove(waiter)
+
+    # Callbacks called by control.parse
+
+    def received_positions(self, positions: PositionFrame, side: int, target_reached: bool,
+                           fault: bool) -> None:
+        state = self.sides[side]
+        state.positions = positions
+        state.target_reached = target_reached
+        state.fault = fault
+        state.updated = datetime.datetime.now()
+        self._publish(Update('positions', side, positions, target_reached, fault))
+
+    def received_target(self, target: PositionFrame, side: int) -> None:
+        self.sides[side].target = target
+        self._publish(Update('target', side, target))
+
+    def received_sensors(self, sensors: List[int], side: int) -> None:
+        self.sides[side].sensors = sensors
+        self._publish(Update('sensors', side, sensors))
+
+    ###########################################################################
+    # Board operations
+
+    async def wait_initialized(self, side: Side, timeout: Optional[float] = None) -> None:
+        await self._wait_for(self.sides[_side(side)].initialized, timeout)
+
+    async def set_positions(self, side: Side, content: Dict[str, Any], wait: bool = True,
+                            timeout: Optional[float] = None) -> None:
+        await self.set_raw(side, protocol.flap_all_positions(content), wait, timeout)
+
+    async def reset(self, side: Side, wait: bool = True, timeout: Optional[float] = None) -> None:
+        await self.set_positions(side, {}, wait, timeout)
+
+    async def set_raw(self, side: Side, positions: Sequence[int], wait: bool = True,
+                      timeout: Optional[float] = None) -> None:
+        _side_i = _side(side)
+        state = self.sides[_side_i]
+        await self.wait_initialized(_side_i, timeout)
+        positions = protocol.encoder.nearest(positions, state.positions, state.target)
+        messages = protocol.plan_update(_side_i, state.target, positions)
+        if messages:
+            state.target = None  # firmware may alter target, wait for its confirmation
+        logging.info(f'Side {protocol.side_str(_side_i)}: positions: {positions}, '
+                     f'{len(messages)} message(s)')
+        for msgtype, data in messages:
+            self.send(msgtype, data)
+        if wait:
+            await self._wait_for(
+                lambda: state.target is not None and state.positions == state.target, timeout)
+
+    async def flap(self, side: Side, unit: int, timeout: Optional[float] = None) -> None:
+        assert 0 <= unit < FLAP_UNITS, 'Invalid unit'
+        _side_i = _side(side)
+        state = self.sides[_side_i]
+        await self.wait_initialized(_side_i, timeout)
+        state.target = None
+        self.send(UART_MSG_MS_FLAP, [_side_i, unit])
+        await self._wait_for(lambda: state.target is not None, timeout)
+
+    async def get_state(self, side: Side, timeout: Optional[float] = None) -> Dict[str, Any]:
+        state = self.sides[_side(side)]
+        state.target = None
+        self.send(UART_MSG_MS_GET_TARGET, [])
+        await self._wait_for(
+            lambda: state.target is not None and state.updated is not None, timeout)
+        return state.explain()
+
+    async def updates(self, maxsize: int = UPDATES_QUEUE) -> AsyncIterator[Update]:
+        # Firmware reports positions every clap, a consumer slower than that loses the oldest
+        # updates instead of growing the queue
+        queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self._subscribers.append(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._subscribers.remove(queue)
@@ -0,0 +1,69 @@
+# edulint: flake8=--max-line-length=100
+
+"""
+Client library for solarid.py board daemon
+
+Example:
+    with SolariClient() as client:
+        client.set_positions('A', {'type': 'Os', 'num': 4321, 'final': 'Tišnov'})
+        print(client.state('A'))
+"""
+
+import socket
+import json
+from typing import Dict, Any, Optional
+
+DEFAULT_SOCKET = '/run/solarid.sock'
+
+
+class SolariError(Exception):
+    pass
+
+
+class SolariClient:
+    def __init__(self, path: str = DEFAULT_SOCKET, timeout: Optional[float] = None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.file = self.sock.makefile('rwb')
+
+    def close(self) -> None:
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self) -> 'SolariClient':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def request(self, cmd: str, **kwargs) -> Dict[str, Any]:
+        kwargs['cmd'] = cmd
+        self.file.write((json.dumps(kwargs, ensure_ascii=False) + '\n').encode('utf-8'))
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise SolariError('Connection closed by solarid')
+        response = json.loads(line)
+        if not response.pop('ok', False):
+            raise SolariError(response.get('error', 'Unknown error'))
+        return response
+
+    def set_positions(self, side: str, content: Dict[str, Any], wait: bool = False,
+                      timeout: Optional[float] = None) -> None:
+        params: Dict[str, Any] = {'side': side, 'content': content, 'wait': wait}
+        if timeout is not None:
+            params['timeout'] = timeout
+        self.request('set', **params)
+
+    def reset(self, side: str, wait: bool = False, timeout: Optional[float] = None) -> None:
+        params: Dict[str, Any] = {'side': side, 'wait': wait}
+        if timeout is not None:
+            params['timeout'] = timeout
+        self.request('reset', **params)
+
+    def flap(self, side: str, unit: int) -> None:
+        self.request('flap', side=side, unit=unit)
+
+    def state(self, side: str) -> Dict[str, Any]:
+        return self.request('state', side=side)
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# edulint: flake8=--max-line-length=100
+
+"""
+HTTP/JSON API of Solari di Udine platform board
+
+Keeps the serial port open exclusively (same as solarid.py), accepts commands
+over HTTP and pushes state changes to browsers as Server-Sent Events. Commands
+are validated and acknowledged at once and executed in background, state is
+served from memory, so neither concurrent users nor polling add any serial
+traffic.
+
+Usage:
+    solari_http.py [options] <device>
+    solari_http.py (-h | --help)
+    solari_http.py --version
+
+Options:
+  -l <loglevel>         Specify loglevel (python logging package) [default: info]
+  --host=<host>         Address to listen on [default: 127.0.0.1]
+  --port=<port>         Port to listen on [default: 8080]
+  --allow-origin=<url>  Value of Access-Control-Allow-Origin for web panel served elsewhere
+  --state-file=<path>   Shared state cache (see statefile.py), 'none' = off [default: auto]
+  --capture=<file>      Write all serial traffic to rotated binary capture (see capture.py)
+
+Endpoints (<side> is A or B, bodies use schema of content.json):
+  POST /set/<side>    content       -> 202 {"ok": true}
+  POST /reset/<side>                -> 202 {"ok": true}
+  POST /flap/<side>   {"unit": 3}   -> 202 {"ok": true}
+  GET  /state[/<side>]              -> state as in `control.py state`
+  GET  /events                      -> text/event-stream
+Invalid requests are answered with 4xx {"ok": false, "error": "..."}.
+
+Events: "state" with {"side": "A", "current": {...}, "target": {...}} when
+positions, target or fault of a side change (sent for both sides on connect),
+"error" with {"side": "A", "cmd": "set", "error": "..."} when a command fails.
+A newer set/reset of a side supersedes the one waiting to be sent.
+
+The API has no authentication, keep it on localhost behind the web server (e.g.
+nginx location with access control) rather than listening on other addresses.
+"""
+
+import sys
+import json
+import queue
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Tuple, Optional
+import serial
+import docopt
+
+import control
+import protocol
+import statefile
+import capture
+import solarid
+from protocol import FLAP_UNITS, UART_MSG_MS_GET_POS, UART_MSG_MS_GET_TARGET
+
+APP_VERSION = '1.0'
+
+SIDES = 2
+KEEPALIVE = 15  # seconds between comments keeping idle event streams open
+SUBSCRIBER_QUEUE = 64  # events buffered per client, slower clients are disconnected
+MAX_BODY = 64*1024  # bytes
+
+
+class Events:
+    """Fan-out of server-sent events to connected clients."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers: List[queue.Queue] = []
+
+    def subscribe(self) -> queue.Queue:
+        subscriber: queue.Queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE)
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue) -> None:
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def subscribed(self, subscriber: queue.Queue) -> bool:
+        with self.lock:
+            return subscriber in self.subscribers
+
+    def publish(self, event: str, data: Dict[str, Any]) -> None:
+        message = encode_event(event, data)
+        with self.lock:
+            for subscriber in list(self.subscribers):
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    logging.warning('Event stream client too slow, disconnecting')
+                    self.subscribers.remove(subscriber)
+
+
+def encode_event(event: str, data: Dict[str, Any]) -> bytes:
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'.encode('utf-8')
+
+
+def side_state(board: solarid.Board, side: int) -> Dict[str, Any]:
+    # Caller holds board.cond
+    result: Dict[str, Any] = {'side': protocol.side_str(side)}
+    result.update(board.sides[side].explain())
+    return result
+
+
+class Commander:
+    """Executes commands of each side in order in a background thread."""
+
+    def __init__(self, board: solarid.Board, events: Events):
+        self.board = board
+        self.events = events
+        self.queues: List[queue.Queue] = [queue.Queue() for _ in range(SIDES)]
+        self.lock = threading.Lock()
+        self.latest = [0] * SIDES  # sequence number of the latest set/reset of each side
+        for side in range(SIDES):
+            threading.Thread(target=self._run, args=(side,), daemon=True,
+                             name=f'commands-{protocol.side_str(side)}').start()
+
+    def set_positions(self, side: int, positions: List[int], cmd: str = 'set') -> None:
+        with self.lock:
+            self.latest[side] += 1
+            self.queues[side].put((cmd, self.latest[side], positions))
+
+    def flap(self, side: int, unit: int) -> None:
+        assert 0 <= unit < FLAP_UNITS, 'Invalid unit'
+        self.queues[side].put(('flap', 0, unit))
+
+    def _run(self, side: int) -> None:
+        while True:
+            cmd, seq, arg = self.queues[side].get()
+            if cmd in ['set', 'reset'] and seq != self.latest[side]:
+                logging.info(f'Side {protocol.side_str(side)}: {cmd} superseded by newer one')
+                continue
+            try:
+                if cmd == 'flap':
+                    self.board.flap(side, arg, solarid.DEFAULT_TIMEOUT)
+                else:
+                    self.board.set_positions(side, arg, False, solarid.DEFAULT_TIMEOUT)
+            except Exception as e:
+                logging.warning(f'Side {protocol.side_str(side)}: {cmd} failed: '
+                                f'{type(e).__name__}: {e}')
+                self.events.publish('error', {
+                    'side': protocol.side_str(side),
+                    'cmd': cmd,
+                    'error': f'{type(e).__name__}: {e}',
+                })
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server: 'Server'
+    protocol_version = 'HTTP/1.1'
+
+    def route(self) -> Tuple[str, Optional[int]]:
+        parts = [part for part in self.path.split('?')[0].split('/') if part]
+        if len(parts) == 1:
+            return parts[0], None
+        if len(parts) == 2 and parts[1].lower() in ['a', 'b']:
+            return parts[0], protocol.side_int(parts[1])
+        return '', None
+
+    def send_json(self, status: int, data: Dict[str, Any]) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_cors_headers()
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_cors_headers(self) -> None:
+        if self.server.allow_origin:
+            self.send_header('Access-Control-Allow-Origin', self.server.allow_origin)
+
+    def read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get('Content-Length', 0))
+        assert length <= MAX_BODY, 'Request body too large'
+        body = self.rfile.read(length) if length > 0 else b''
+        data = json.loads(body) if body.strip() else {}
+        assert isinstance(data, dict), 'Request body must be a JSON object'
+        return data
+
+    def do_OPTIONS(self) -> None:  # CORS preflight
+        self.send_response(204)
+        self.send_cors_headers()
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self) -> None:
+        board = self.server.board
+        endpoint, side = self.route()
+        if endpoint == 'events' and side is None:
+            self.stream_events()
+        elif endpoint == 'state':
+            with board.cond:
+                if side is not None:
+                    self.send_json(200, board.sides[side].explain())
+                else:
+                    self.send_json(200, {protocol.side_str(side): board.sides[side].explain()
+                                         for side in range(SIDES)})
+        else:
+            self.send_json(404, {'ok': False, 'error': 'Not found'})
+
+    def do_POST(self) -> None:
+        commander = self.server.commander
+        endpoint, side = self.route()
+        if endpoint not in ['set', 'reset', 'flap'] or side is None:
+            self.send_json(404, {'ok': False, 'error': 'Not found'})
+            return
+        try:
+            request = self.read_json()
+            logging.debug(f'Request: {endpoint} {protocol.side_str(side)} {request}')
+            if endpoint == 'set':
+                commander.set_positions(side, protocol.flap_all_positions(request))
+            elif endpoint == 'reset':
+                commander.set_positions(side, protocol.flap_all_positions({}), 'reset')
+            else:
+                commander.flap(side, int(request['unit']))
+        except Exception as e:
+            logging.warning(f'Request failed: {type(e).__name__}: {e}')
+            self.send_json(400, {'ok': False, 'error': f'{type(e).__name__}: {e}'})
+            return
+        self.send_json(202, {'ok': True})
+
+    def stream_events(self) -> None:
+        board = self.server.board
+        events = self.server.events
+        with board.cond:  # no change may fall between the snapshot and subscription
+            subscriber = events.subscribe()
+            snapshot = [side_state(board, side) for side in range(SIDES)]
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_cors_headers()
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for state in snapshot:
+                self.wfile.write(encode_event('state', state))
+            self.wfile.flush()
+            while True:
+                try:
+                    message = subscriber.get(timeout=KEEPALIVE)
+                except queue.Empty:
+                    if not events.subscribed(subscriber):
+                        return
+                    message = b': keepalive\n\n'
+                self.wfile.write(message)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            events.unsubscribe(subscriber)
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug(f'{self.address_string()} {format % args}')
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], board: solarid.Board,
+                 allow_origin: Optional[str] = None):
+        self.board = board
+        self.events = Events()
+        self.commander = Commander(board, self.events)
+        self.allow_origin = allow_origin
+        board.listeners.append(
+            lambda side: self.events.publish('state', side_state(board, side)))
+        super().__init__(address, RequestHandler)
+
+
+###############################################################################
+# Main
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__, version=APP_VERSION)
+
+    loglevel = {
+        'debug': logging.DEBUG,
+        'info': logging.INFO,
+        'warning': logging.WARNING,
+        'error': logging.ERROR,
+        'critical': logging.CRITICAL,
+    }.get(args['-l'], logging.INFO)
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=loglevel,
+        format='[%(asctime)s.%(msecs)03d] %(levelname)s %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+
+    sport = serial.Serial(args['<device>'], 115200, exclusive=True)
+    logging.debug(f'Connected to {args["<device>"]}')
+    if args['--capture']:
+        sport = capture.CapturingPort(sport, capture.Capture(args['--capture']))
+    board = solarid.Board(sport)
+
+    if args['--state-file'] != 'none':
+        state_path = statefile.default_path(args['<device>']) \
+            if args['--state-file'] == 'auto' else args['--state-file']
+        control.state_file = statefile.StateFile(state_path, writable=True)
+        logging.info(f'Sharing state in {state_path}')
+
+    server = Server((args['--host'], int(args['--port'])), board, args['--allow-origin'])
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f'Listening on http://{args["--host"]}:{args["--port"]}/')
+
+    board.send(UART_MSG_MS_GET_POS, [])
+    board.send(UART_MSG_MS_GET_TARGET, [])
+    control.receive_loop(sport, board)
+
+    server.server_close()
+    sys.stderr.write('Port interrupt!\n')
+    sys.exit(1)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# edulint: flake8=--max-line-length=100
+
+"""
+Solari di Udine platform board daemon
+
+Keeps the serial port open, tracks state of both sides of the board and
+accepts commands from clients (see solari_client.py) on a Unix socket.
+The port is held exclusively: control.py (and hJOP integration running it)
+or solari_http.py cannot open it while the daemon runs.
+
+Usage:
+    solarid.py [options] <device>
+    solarid.py (-h | --help)
+    solarid.py --version
+
+Options:
+  -l <loglevel>     Specify loglevel (python logging package) [default: info]
+  -S <socket>       Unix socket path [default: /run/solarid.sock]
+  -m <mode>         Unix socket permissions (octal) [default: 660]
+  --state-file=<path>  Shared state cache (see statefile.py), 'none' = off [default: auto]
+  --capture=<file>  Write all serial traffic to rotated binary capture (see capture.py)
+
+Protocol: one JSON object per line in both directions.
+  {"cmd": "set", "side": "A", "content": {...}, "wait": false, "timeout": 120}
+  {"cmd": "reset", "side": "A", "wait": false, "timeout": 120}
+  {"cmd": "flap", "side": "A", "unit": 3}
+  {"cmd": "state", "side": "A"}
+Each request is answered with {"ok": true, ...} or {"ok": false, "error": "..."}.
+"""
+
+import os
+import sys
+import json
+import logging
+import datetime
+import threading
+import socketserver
+from typing import List, Dict, Any, Callable
+import serial
+import docopt
+
+import control
+import protocol
+import statefile
+import capture
+from protocol import FLAP_UNITS, PositionFrame, SideState, UART_MSG_MS_GET_POS, \
+    UART_MSG_MS_GET_TARGET, UART_MSG_MS_FLAP
+
+APP_VERSION = '1.0'
+
+DEFAULT_TIMEOUT = 120  # seconds
+
+
+class Board:
+    """State of both sides of the board, updated from the receive thread."""
+
+    def __init__(self, sport):
+        self.sport = sport
+        self.sides = [SideState(), SideState()]
+        self.cond = threading.Condition()
+        self.send_lock = threading.Lock()
+        self.pacer = protocol.SendPacer()
+        # Called with side index (under self.cond) when positions, target or fault change
+        self.listeners: List[Callable[[int], None]] = []
+
+    def send(self, msgtype: int, data: List[int]) -> None:
+        with self.send_lock:
+            protocol.send_spaced(self.sport, msgtype, data, self.pacer)
+
+    # Callbacks called by control.parse from the receive thread
+
+    def received_positions(self, positions: PositionFrame, side: int, target_reached: bool,
+                           fault: bool) -> None:
+        with self.cond:
+            state = self.sides[side]
+            changed = state.positions != positions or state.target_reached != target_reached \
+                or state.fault != fault
+            state.positions = positions
+            state.target_reached = target_reached
+            state.fault = fault
+            state.updated = datetime.datetime.now()
+            self.cond.notify_all()
+            if changed:
+                self._changed(side)
+
+    def received_target(self, target: PositionFrame, side: int) -> None:
+        with self.cond:
+            changed = self.sides[side].target != target
+            self.sides[side].target = target
+            self.cond.notify_all()
+            if changed:
+                self._changed(side)
+
+    def received_sensors(self, sensors: List[int], side: int) -> None:
+        with self.cond:
+            self.sides[side].sensors = sensors
+
+    def _changed(self, side: int) -> None:
+        for listener in self.listeners:
+            listener(side)
+
+    # Commands called from client threads
+
+    def wait_initialized(self, side: int, timeout: float) -> None:
+        with self.cond:
+            if not self.cond.wait_for(self.sides[side].initialized, timeout):
+                raise TimeoutError('Device not initialized')
+
+    def set_positions(self, side: int, positions: List[int], wait: bool, timeout: float) -> None:
+        self.wait_initialized(side, timeout)
+        state = self.sides[side]
+        with self.cond:
+            positions = protocol.encoder.nearest(positions, state.positions, state.target)
+            messages = protocol.plan_update(side, state.target, positions)
+            if messages:
+                # Target is unknown until the device confirms it, firmware may alter it
+                state.target = None
+        logging.info(f'Side {protocol.side_str(side)}: positions: {positions}, '
+                     f'{len(messages)} message(s)')
+        for msgtype, data in messages:
+            self.send(msgtype, data)
+        if wait:
+            with self.cond:
+                if not self.cond.wait_for(
+                        lambda: state.target is not None and state.positions == state.target,
+                        timeout):
+                    raise TimeoutError('Target not reached')
+
+    def flap(self, side: int, unit: int, timeout: float) -> None:
+        assert 0 <= unit < FLAP_UNITS, 'Invalid unit'
+        self.wait_initialized(side, timeout)
+        self.send(UART_MSG_MS_FLAP, [side, unit])
+
+    def state(self, side: int) -> Dict[str, Any]:
+        with self.cond:
+            return self.sides[side].explain()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response: Dict[str, Any] = {'ok': True}
+                response.update(self.process(json.loads(line)))
+            except Exception as e:
+                logging.warning(f'Request failed: {type(e).__name__}: {e}')
+                response = {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+            self.wfile.write((json.dumps(response, ensure_ascii=False) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+    def process(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        board: Board = self.server.board  # type: ignore
+        cmd = request.get('cmd')
+        side = protocol.side_int(request.get('side', ''))
+        timeout = float(request.get('timeout', DEFAULT_TIMEOUT))
+        logging.debug(f'Request: {request}')
+
+        if cmd == 'set':
+            positions = protocol.flap_all_positions(request.get('content', {}))
+            board.set_positions(side, positions, request.get('wait', False), timeout)
+            return {}
+        if cmd == 'reset':
+            board.set_positions(side, protocol.flap_all_positions({}),
+                                request.get('wait', False), timeout)
+            return {}
+        if cmd == 'flap':
+            board.flap(side, int(request['unit']), timeout)
+            return {}
+        if cmd == 'state':
+            return board.state(side)
+
+        assert False, f'Unknown command: {cmd}'
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, board: Board):
+        self.board = board
+        super().__init__(path, RequestHandler)
+
+
+###############################################################################
+# Main
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__, version=APP_VERSION)
+
+    loglevel = {
+        'debug': logging.DEBUG,
+        'info': logging.INFO,
+        'warning': logging.WARNING,
+        'error': logging.ERROR,
+        'critical': logging.CRITICAL,
+    }.get(args['-l'], logging.INFO)
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=loglevel,
+        format='[%(asctime)s.%(msecs)03d] %(levelname)s %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+
+    sport = serial.Serial(args['<device>'], 115200, exclusive=True)
+    logging.debug(f'Connected to {args["<device>"]}')
+    if args['--capture']:
+        sport = capture.CapturingPort(sport, capture.Capture(args['--capture']))
+    board = Board(sport)
+
+    if args['--state-file'] != 'none':
+        state_path = statefile.default_path(args['<device>']) \
+            if args['--state-file'] == 'auto' else args['--state-file']
+        control.state_file = statefile.StateFile(state_path, writable=True)
+        logging.info(f'Sharing state in {state_path}')
+
+    if os.path.exists(args['-S']):
+        os.unlink(args['-S'])
+    server = Server(args['-S'], board)
+    os.chmod(args['-S'], int(args['-m'], 8))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f'Listening on {args["-S"]}')
+
+    board.send(UART_MSG_MS_GET_POS, [])
+    board.send(UART_MSG_MS_GET_TARGET, [])
+    control.receive_loop(sport, board)
+
+    server.server_close()
+    os.unlink(args['-S'])
+    sys.stderr.write('Port interrupt!\n')
+    sys.exit(1)
@@ -0,0 +1,149 @@
+# edulint: flake8=--max-line-length=100
+
+"""
+Shared on-disk cache of Solari di Udine platform board state
+
+The process holding the serial port writes state of both sides into a small
+memory-mapped file with fixed layout on every received frame, other processes
+(control.py state --cached, web, monitoring) read it without touching the UART.
+The file lives in root-owned STATE_DIR and is opened without following
+symlinks, the writer refuses a file that is not its own regular file.
+Each side record starts with a sequence number which is odd while the record
+is being written, readers retry until they get a consistent copy.
+
+Layout (little endian): header '<4sB3x' (magic, version), then record
+'<IdB26s26s8s' for side A and B: sequence, time of last update (unix time),
+flags, positions, target, sensors.
+"""
+
+import os
+import mmap
+import stat
+import time
+import struct
+from typing import List, Optional, NamedTuple
+
+import protocol
+
+STATE_DIR = '/run/solari'  # RuntimeDirectory= of the systemd units
+MAGIC = b'SOLS'
+VERSION = 1
+HEADER = struct.Struct('<4sB3x')
+RECORD = struct.Struct('<IdB26s26s8s')
+SEQUENCE = struct.Struct('<I')
+SIDES = 2
+FILE_SIZE = HEADER.size + SIDES*RECORD.size
+SENSORS_LEN = 8
+
+FLAG_TARGET_REACHED = 0x01
+FLAG_FAULT = 0x02
+FLAG_POSITIONS = 0x04  # positions known
+FLAG_TARGET = 0x08  # target known
+FLAG_SENSORS = 0x10  # sensors known
+
+READ_RETRIES = 100
+READ_RETRY_DELAY = 0.001  # seconds
+
+
+def default_path(device: str) -> str:
+    return os.path.join(STATE_DIR, f'solari-{os.path.basename(device)}.state')
+
+
+class CachedSide(NamedTuple):
+    updated: float  # unix time
+    positions: 'protocol.PositionFrame'
+    target: Optional['protocol.PositionFrame']
+    sensors: Optional[List[int]]
+    target_reached: bool
+    fault: bool
+
+    def age(self) -> float:
+        return time.time() - self.updated
+
+
+class StateFile:
+    def __init__(self, filename: str, writable: bool = False):
+        self.filename = filename
+        header = HEADER.pack(MAGIC, VERSION)
+        flags = os.O_RDWR | os.O_CREAT if writable else os.O_RDONLY
+        fd = os.open(filename, flags | os.O_NOFOLLOW, 0o644)
+        try:
+            st = os.fstat(fd)
+            if not stat.S_ISREG(st.st_mode) or (writable and st.st_uid != os.geteuid()):
+                raise PermissionError(f'{filename}: not a regular file owned by this user')
+            if writable and os.fstat(fd).st_size != FILE_SIZE:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, FILE_SIZE)
+            self.mm = mmap.mmap(fd, FILE_SIZE,
+                                access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+
+        if writable:
+            if self.mm[:HEADER.size] != header:
+                self.mm[:] = bytes(FILE_SIZE)
+                self.mm[:HEADER.size] = header
+            # Values of records kept by the writer, whole record is rewritten on each change
+            self.records = [list(RECORD.unpack_from(self.mm, self.offset(side)))
+                            for side in range(SIDES)]
+        else:
+            assert self.mm[:HEADER.size] == header, f'{filename}: not a state file of this version'
+
+    @staticmethod
+    def offset(side: int) -> int:
+        return HEADER.size + side*RECORD.size
+
+    def close(self) -> None:
+        self.mm.close()
+
+    # Writing (process holding the serial port)
+
+    def _write(self, side: int, flags_set: int, flags_clear: int = 0, **fields: bytes) -> None:
+        record = self.records[side]
+        seq, _, flags, positions, target, sensors = record
+        flags = (flags & ~flags_clear) | flags_set
+        positions = fields.get('positions', positions)
+        target = fields.get('target', target)
+        sensors = fields.get('sensors', sensors)
+        offset = self.offset(side)
+        SEQUENCE.pack_into(self.mm, offset, seq+1)  # odd = being written
+        RECORD.pack_into(self.mm, offset, seq+1, time.time(), flags, positions, target, sensors)
+        SEQUENCE.pack_into(self.mm, offset, seq+2)
+        record[:] = [seq+2, 0.0, flags, positions, target, sensors]
+
+    def positions(self, side: int, positions: 'protocol.PositionFrame', target_reached: bool,
+                  fault: bool) -> None:
+        flags = FLAG_POSITIONS | (FLAG_TARGET_REACHED if target_reached else 0) | \
+            (FLAG_FAULT if fault else 0)
+        self._write(side, flags, FLAG_TARGET_REACHED | FLAG_FAULT, positions=positions.raw)
+
+    def target(self, side: int, target: 'protocol.PositionFrame') -> None:
+        self._write(side, FLAG_TARGET, target=target.raw)
+
+    def sensors(self, side: int, sensors: List[int]) -> None:
+        self._write(side, FLAG_SENSORS, sensors=bytes(sensors[:SENSORS_LEN]))
+
+    # Reading
+
+    def read(self, side: int) -> Optional[CachedSide]:
+        # Returns None when positions of the side are not known (or record stays inconsistent)
+        offset = self.offset(side)
+        for _ in range(READ_RETRIES):
+            record = RECORD.unpack_from(self.mm, offset)
+            if record[0] % 2 == 0 and SEQUENCE.unpack_from(self.mm, offset)[0] == record[0]:
+                break
+            time.sleep(READ_RETRY_DELAY)
+        else:
+            return None
+
+        _, updated, flags, positions, target, sensors = record
+        if not flags & FLAG_POSITIONS:
+            return None
+        return CachedSide(
+            updated=updated,
+            positions=protocol.PositionFrame(positions),
+            target=protocol.PositionFrame(target) if flags & FLAG_TARGET else None,
+            sensors=list(sensors) if flags & FLAG_SENSORS else None,
+            target_reached=bool(flags & FLAG_TARGET_REACHED),
+            fault=bool(flags & FLAG_FAULT),
+        )
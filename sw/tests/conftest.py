@@ -0,0 +1,8 @@
+# edulint: flake8=--max-line-length=100
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, 'sw'))
+sys.path.insert(0, os.path.join(ROOT, 'fw'))
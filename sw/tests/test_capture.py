@@ -0,0 +1,51 @@
+# edulint: flake8=--max-line-length=100
+
+import mmap
+from typing import List
+
+import capture
+import protocol
+import emulator
+
+
+class ChunkedPort:
+    """Port returning prepared data in small chunks, as a real port often does."""
+
+    def __init__(self, data: bytes, chunk: int):
+        self.chunks = [data[i:i+chunk] for i in range(0, len(data), chunk)]
+
+    def read(self, size: int = 1) -> bytes:
+        return self.chunks.pop(0) if self.chunks else b''
+
+
+def frames(count: int) -> List[bytes]:
+    return [emulator.frame(protocol.UART_MSG_SM_POS, [i % 2 | 2] + [i % 10]*protocol.FLAP_UNITS)
+            for i in range(count)]
+
+
+def read_records(filename: str) -> List[bytes]:
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return [bytes(data) for _, _, data in capture.records(mm)]
+
+
+def capture_stream(tmp_path, data: bytes, chunk: int) -> List[bytes]:
+    filename = str(tmp_path / f'board-{chunk}.cap')
+    cap = capture.Capture(filename)
+    port = capture.CapturingPort(ChunkedPort(data, chunk), cap)
+    while port.read(64):
+        pass
+    cap.close()
+    return read_records(filename)
+
+
+def test_one_record_per_frame(tmp_path):
+    sent = frames(50)
+    for chunk in [1, 2, 7]:
+        assert capture_stream(tmp_path, b''.join(sent), chunk) == sent
+
+
+def test_bytes_between_frames_are_kept(tmp_path):
+    sent = frames(3)
+    data = b'\x00\x01' + sent[0] + sent[1] + b'\x02' + sent[2]
+    records = capture_stream(tmp_path, data, 2)
+    assert records == [b'\x00\x01', sent[0], sent[1], b'\x02', sent[2]]
@@ -0,0 +1,37 @@
+# edulint: flake8=--max-line-length=100
+
+import pytest
+
+import protocol
+
+
+def test_pacer_counts_gap_from_end_of_frame_on_wire():
+    pacer = protocol.SendPacer(115200)
+    assert pacer.reserve(10.0, 27) == 10.0  # SET_ALL
+    on_wire = 31*10/115200
+    assert pacer.reserve(10.0, 27) == pytest.approx(10.0 + on_wire + 0.002)
+    assert pacer.reserve(11.0, 0) == 11.0
+
+
+def pos_frame(value: int) -> bytes:
+    data = [protocol.UART_RECEIVE_MAGIC, protocol.FLAP_UNITS+1, protocol.UART_MSG_SM_POS, 2]
+    data += [value]*protocol.FLAP_UNITS
+    return bytes(data + [protocol.xor(data)])
+
+
+def test_feed_buffers_data_without_iterating():
+    decoder = protocol.FrameDecoder()
+    data = pos_frame(1) + pos_frame(2)
+    decoder.feed(data[:20], now=0)  # result ignored, bytes must be kept anyway
+    frames = decoder.feed(data[20:], now=0.01)
+    assert [bytes(frame) for frame in frames] == [pos_frame(1), pos_frame(2)]
+    assert decoder.received == len(data) and decoder.discarded == 0
+
+
+def test_frames_are_valid_until_next_feed():
+    decoder = protocol.FrameDecoder()
+    frames = decoder.feed(pos_frame(1) + pos_frame(2)[:10], now=0)
+    assert [bytes(frame) for frame in frames] == [pos_frame(1)]
+    assert [bytes(frame) for frame in decoder.feed(pos_frame(2)[10:], now=0.01)] == [pos_frame(2)]
+    with pytest.raises(ValueError):
+        bytes(frames[0])  # released by the second feed()
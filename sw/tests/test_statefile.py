@@ -0,0 +1,35 @@
+# edulint: flake8=--max-line-length=100
+
+import os
+
+import pytest
+
+import protocol
+import statefile
+
+
+def test_state_is_shared(tmp_path):
+    filename = str(tmp_path / 'board.state')
+    writer = statefile.StateFile(filename, writable=True)
+    writer.positions(1, protocol.PositionFrame([3]*protocol.FLAP_UNITS), True, False)
+    reader = statefile.StateFile(filename)
+    cached = reader.read(1)
+    assert cached is not None and list(cached.positions) == [3]*protocol.FLAP_UNITS
+    assert cached.target_reached and reader.read(0) is None
+    reader.close()
+    writer.close()
+
+
+def test_symlink_is_refused(tmp_path):
+    victim = tmp_path / 'victim'
+    victim.write_bytes(b'precious')
+    os.symlink(victim, tmp_path / 'board.state')
+    with pytest.raises(OSError):
+        statefile.StateFile(str(tmp_path / 'board.state'), writable=True)
+    assert victim.read_bytes() == b'precious'
+
+
+def test_non_regular_file_is_refused(tmp_path):
+    os.mkfifo(tmp_path / 'board.state')
+    with pytest.raises(PermissionError):
+        statefile.StateFile(str(tmp_path / 'board.state'), writable=True)
@@ -0,0 +1,68 @@
+# edulint: flake8=--max-line-length=100
+
+import io
+import sys
+import json
+from typing import List
+
+import pytest
+
+import control
+import protocol
+import emulator
+
+
+class EmulatedPort:
+    """Serial port connected to in-process firmware emulator, time is advanced by run()."""
+
+    def __init__(self):
+        self.emulator = emulator.Emulator(initialized=True, seed=0)
+        self.now = 0.0
+
+    def write(self, data) -> None:
+        self.emulator.feed(bytes(data), self.now)
+
+
+def run_session(commands: List[dict], capsys, monkeypatch,
+                max_seconds: float = 60.0) -> List[dict]:
+    # Runs stream session until all commands are answered, returns result lines
+    monkeypatch.setitem(control.args, '--counts', None)
+    monkeypatch.setattr(sys, 'stdin', io.StringIO(''.join(json.dumps(c) + '\n' for c in commands)))
+    port = EmulatedPort()
+    decoder = protocol.FrameDecoder()
+    stream = control.Stream(port)
+
+    with pytest.raises(SystemExit):
+        while port.now < max_seconds:
+            port.now = port.emulator.next_event()
+            port.emulator.tick(port.now)
+            for frame in decoder.feed(port.emulator.output(), now=port.now):
+                control.parse(frame, stream)
+            stream.iter()
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+def test_wait_after_flap_waits_for_new_target(capsys, monkeypatch):
+    results = run_session([
+        {'cmd': 'flap', 'side': 'A', 'unit': 1},
+        {'cmd': 'wait', 'side': 'A'},
+        {'cmd': 'state', 'side': 'A'},
+    ], capsys, monkeypatch)
+
+    assert [result['ok'] for result in results] == [True, True, True]
+    state = results[2]['state']['A']
+    assert state['target']['raw']['num'][0] == 1
+    assert state['current']['raw']['num'][0] == 1
+    assert state['current']['target_reached']
+
+
+def test_malformed_commands_do_not_end_session(capsys, monkeypatch):
+    results = run_session([
+        {'cmd': 'set', 'side': 5},
+        {'cmd': 'set', 'timeout': [1]},
+        {'cmd': 'set', 'content': 'x'},
+        {'cmd': 'flap', 'unit': protocol.FLAP_UNITS},
+        {'cmd': 'state', 'side': 'A'},
+    ], capsys, monkeypatch)
+
+    assert [result['ok'] for result in results] == [False, False, False, False, True]
@@ -0,0 +1,32 @@
+# edulint: flake8=--max-line-length=100
+
+import timetable
+
+
+def departure(time: str, final: str, **extra) -> dict:
+    return {'track': 1, 'type': 'Os', 'num': 4711, 'final': final, 'time': time, **extra}
+
+
+def test_default_show_follows_previous_departure():
+    records, errors = timetable.compile_entries([
+        departure('10:00', 'Brno'),
+        departure('10:30', 'Tišnov'),
+    ])
+    assert errors == []
+    assert [minute for _, minute, _ in records] == [0, 10*60+1, 10*60+31]
+
+
+def test_show_before_previous_departure_is_rejected():
+    _, errors = timetable.compile_entries([
+        departure('10:00', 'Brno'),
+        departure('10:30', 'Tišnov', show='9:00'),
+    ])
+    assert len(errors) == 1 and 'not after previous departure' in errors[0]
+
+
+def test_show_at_previous_departure_is_rejected():
+    _, errors = timetable.compile_entries([
+        departure('10:00', 'Brno'),
+        departure('10:30', 'Tišnov', show='10:00'),
+    ])
+    assert len(errors) == 1
@@ -0,0 +1,211 @@
+# edulint: flake8=--max-line-length=100
+
+"""
+Timetable compiler & lookup of precompiled board vectors
+
+Departures (JSON list of content.json-like objects or CSV with the same
+columns) carry "track" and departure "time", optionally "show" (time the entry
+appears on the board, after the previous departure). By default an entry is
+shown from one minute after the previous departure on its track (first one
+from midnight), the board is blank after the last departure. Everything is
+validated and encoded at compile time, player only looks vectors up.
+
+Binary layout (little endian): header '<4sBxxxI' (magic, version, number of
+records), then records '<HH26s' (track, minute of day the vector is due from,
+positions) sorted by track & minute.
+"""
+
+import csv
+import json
+import mmap
+import struct
+import logging
+from typing import List, Dict, Any, Optional, Tuple
+
+import protocol
+
+MAGIC = b'SOLT'
+VERSION = 1
+HEADER = struct.Struct('<4sBxxxI')
+RECORD = struct.Struct('<HH26s')
+MINUTES_PER_DAY = 24*60
+TRACK_MAX = 0xFFFF
+
+Record = Tuple[int, int, bytes]  # track, due minute, positions
+
+CONTENT_KEYS = ['type', 'num', 'num_red', 'final', 'direction1', 'direction2', 'time', 'delay']
+
+
+def parse_minute(value: Any) -> int:  # 'H:MM' -> minute of day
+    hours, minutes = map(int, str(value).split(':'))
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f'Invalid time: {value}')
+    return hours*60 + minutes
+
+
+def load_entries(filename: str) -> List[Dict[str, Any]]:
+    if not filename.lower().endswith('.csv'):
+        with open(filename) as f:
+            return json.load(f)
+
+    entries = []
+    with open(filename, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            entry: Dict[str, Any] = {key: value for key, value in row.items()
+                                     if key is not None and value not in (None, '')}
+            for key in ['track', 'num']:
+                if key in entry and entry[key].isdecimal():
+                    entry[key] = int(entry[key])
+            if 'num_red' in entry:
+                entry['num_red'] = entry['num_red'].lower() in ['1', 'true', 'yes']
+            entries.append(entry)
+    return entries
+
+
+def validate(entry: Dict[str, Any]) -> List[str]:  # returns all errors found in the entry
+    errors = []
+    unknown = set(entry.keys()) - set(CONTENT_KEYS) - {'track', 'show'}
+    if unknown:
+        errors.append(f'unknown keys {sorted(unknown)}')
+
+    track = entry.get('track')
+    if not isinstance(track, int) or not 0 <= track <= TRACK_MAX:
+        errors.append(f'invalid track {track!r}')
+    if 'time' not in entry:
+        errors.append('departure time missing')
+    minutes: Dict[str, int] = {}
+    for key in ['time', 'show']:
+        if key in entry:
+            try:
+                minutes[key] = parse_minute(entry[key])
+            except ValueError:
+                errors.append(f'invalid {key} {entry[key]!r}')
+    if 'time' in minutes and 'show' in minutes and minutes['show'] > minutes['time']:
+        errors.append(f'show {entry["show"]!r} later than departure time {entry["time"]!r}')
+
+    if 'type' in entry and entry['type'] not in protocol.FLAP_TYPES:
+        errors.append(f'unknown type {entry["type"]!r}')
+    if 'num' in entry and (not isinstance(entry['num'], int) or
+                           not 0 <= entry['num'] < 10**protocol.FLAP_TRAINNUM_COUNT):
+        errors.append(f'invalid number {entry["num"]!r}')
+    if 'final' in entry:
+        missing = sorted({letter for letter in str(entry['final']).lower()
+                          if letter not in protocol.FLAP_ALPHABET})
+        if missing:
+            errors.append(f'letters {missing} of final {entry["final"]!r} not available')
+    for key, labels in [('direction1', protocol.FLAP_DIRECTIONS_1),
+                        ('direction2', protocol.FLAP_DIRECTIONS_2)]:
+        if key in entry and entry[key] not in labels:
+            errors.append(f'unknown {key} {entry[key]!r}')
+    if 'delay' in entry:
+        try:
+            protocol.flap_delay(str(entry['delay']))
+        except (AssertionError, ValueError):
+            errors.append(f'invalid delay {entry["delay"]!r}')
+
+    if not errors:
+        try:
+            protocol.flap_all_positions(content(entry))
+        except (AssertionError, ValueError, KeyError, TypeError) as e:
+            errors.append(str(e))
+    return errors
+
+
+def content(entry: Dict[str, Any]) -> Dict[str, Any]:
+    result = {key: entry[key] for key in CONTENT_KEYS if key in entry}
+    if 'delay' in result:
+        result['delay'] = str(result['delay'])
+    return result
+
+
+def compile_entries(entries: List[Dict[str, Any]]) -> Tuple[List[Record], List[str]]:
+    # Returns records & all errors
+    errors = []
+    tracks: Dict[int, List[Dict[str, Any]]] = {}
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            errors.append(f'Entry {i+1}: not an object')
+            continue
+        entry_errors = validate(entry)
+        errors += [f'Entry {i+1} (track {entry.get("track")}, {entry.get("time")}): {error}'
+                   for error in entry_errors]
+        if not entry_errors:
+            tracks.setdefault(entry['track'], []).append(entry)
+
+    records = []
+    for track, track_entries in sorted(tracks.items()):
+        track_entries.sort(key=lambda entry: parse_minute(entry['time']))
+        due: Dict[int, Dict[str, Any]] = {}
+        previous = -1  # departure minute of previous entry
+        for entry in track_entries:
+            minute = parse_minute(entry['show']) if 'show' in entry else previous+1
+            if minute <= previous:
+                errors.append(f'Track {track}: {entry["time"]} shown from {entry["show"]}, '
+                              f'not after previous departure')
+            elif minute in due:
+                errors.append(f'Track {track}: {entry["time"]} and {due[minute]["time"]} '
+                              f'shown from the same minute')
+            due[minute] = entry
+            previous = parse_minute(entry['time'])
+            positions = protocol.flap_all_positions(content(entry))
+            records.append((track, minute, bytes(positions)))
+        if previous+1 < MINUTES_PER_DAY and previous+1 not in due:
+            records.append((track, previous+1, bytes(protocol.FLAP_UNITS)))  # blank
+    records.sort(key=lambda record: record[:2])
+    return records, errors
+
+
+def write(filename: str, records: List[Record]) -> None:
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(records)))
+        for record in records:
+            f.write(RECORD.pack(*record))
+
+
+def compile_file(source: str, output: str) -> int:  # returns exit code
+    records, errors = compile_entries(load_entries(source))
+    for error in errors:
+        logging.error(error)
+    if errors:
+        logging.error(f'{len(errors)} error(s), {output} not written')
+        return 1
+    write(output, records)
+    tracks = len({record[0] for record in records})
+    logging.info(f'{len(records)} vectors of {tracks} track(s) written to {output}')
+    return 0
+
+
+class Timetable:
+    """Memory-mapped compiled timetable."""
+
+    def __init__(self, filename: str):
+        with open(filename, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = HEADER.unpack_from(self.mm)
+        assert magic == MAGIC and version == VERSION, f'{filename}: not a compiled timetable'
+        assert len(self.mm) == HEADER.size + self.count*RECORD.size, f'{filename}: truncated'
+
+    def key(self, index: int) -> Tuple[int, int]:  # (track, due minute)
+        return RECORD.unpack_from(self.mm, HEADER.size + index*RECORD.size)[:2]
+
+    def vector(self, index: int) -> bytes:
+        return RECORD.unpack_from(self.mm, HEADER.size + index*RECORD.size)[2]
+
+    def bisect(self, key: Tuple[int, int]) -> int:  # index of first record with key > `key`
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo+hi) // 2
+            if self.key(mid) <= key:
+                lo = mid+1
+            else:
+                hi = mid
+        return lo
+
+    def due(self, track: int, minute: int) -> Optional[int]:
+        # Index of record shown on `track` at `minute`, records of previous day wrap around
+        first = self.bisect((track, -1))
+        end = self.bisect((track, MINUTES_PER_DAY))
+        if first == end:
+            return None
+        index = self.bisect((track, minute)) - 1
+        return index if index >= first else end-1